@@ -0,0 +1,182 @@
+"""
+Online backfill runner for Dating Bot
+Rewrites large tables in small keyset-paginated chunks while the bot keeps serving
+
+Usage:
+    python backfill.py                       # list jobs and their progress
+    python backfill.py users_age_years       # run (or resume) a job
+    python backfill.py users_age_years --rate 500 --chunk 200
+"""
+import argparse
+import logging
+import sqlite3
+import time
+from typing import Callable, Dict, Optional, Sequence
+
+from config import DATABASE_PATH, DB_BUSY_TIMEOUT, BACKFILL_CHUNK_SIZE, BACKFILL_ROWS_PER_SEC
+from migrations import migrate
+
+logger = logging.getLogger(__name__)
+
+
+class BackfillJob:
+    """One backfill: which rows to read and how to turn a row into UPDATE parameters"""
+    def __init__(self, name: str, table: str, key: str, columns: Sequence[str], update_sql: str,
+                 transform: Callable[[tuple], Optional[tuple]]):
+        self.name = name
+        self.table = table
+        self.key = key  # Integer primary key used for keyset pagination
+        self.columns = columns
+        self.update_sql = update_sql
+        self.transform = transform  # (key, *columns) -> UPDATE params, or None to skip the row
+
+    @property
+    def select_sql(self) -> str:
+        return (
+            f'SELECT {self.key}, {", ".join(self.columns)} FROM {self.table} '
+            f'WHERE {self.key} > ? ORDER BY {self.key} LIMIT ?'
+        )
+
+
+def parse_age(age) -> Optional[int]:
+    """Whole-number age from the free-text answer, None when it isn't one"""
+    if age is None:
+        return None
+    try:
+        return int(str(age).strip())
+    except ValueError:
+        return None
+
+
+def _age_years_params(row: tuple) -> Optional[tuple]:
+    user_id, age, age_years = row
+    parsed = parse_age(age)
+    if parsed == age_years:
+        return None
+    return (parsed, user_id)
+
+
+JOBS: Dict[str, BackfillJob] = {
+    'users_age_years': BackfillJob(
+        name='users_age_years',
+        table='users',
+        key='user_id',
+        columns=('age', 'age_years'),
+        update_sql='UPDATE users SET age_years = ? WHERE user_id = ?',
+        transform=_age_years_params,
+    ),
+}
+
+
+def load_checkpoint(conn: sqlite3.Connection, job: BackfillJob) -> tuple:
+    """Return (last_key, rows_done, completed) for a job"""
+    row = conn.execute(
+        'SELECT last_key, rows_done, completed FROM backfill_progress WHERE job_name = ?',
+        (job.name,)
+    ).fetchone()
+    if not row:
+        return None, 0, False
+    return row[0], row[1] or 0, bool(row[2])
+
+
+def _save_checkpoint(cursor: sqlite3.Cursor, job: BackfillJob, last_key, rows_done: int, completed: bool):
+    cursor.execute('''
+        INSERT INTO backfill_progress (job_name, last_key, rows_done, completed, updated_at)
+        VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)
+        ON CONFLICT(job_name) DO UPDATE SET
+            last_key = excluded.last_key,
+            rows_done = excluded.rows_done,
+            completed = excluded.completed,
+            updated_at = excluded.updated_at
+    ''', (job.name, last_key, rows_done, completed))
+
+
+def run_backfill(conn: sqlite3.Connection, job: BackfillJob, chunk_size: int = BACKFILL_CHUNK_SIZE,
+                 rows_per_sec: float = BACKFILL_ROWS_PER_SEC, restart: bool = False) -> int:
+    """Run a job to completion from its last checkpoint; returns rows updated this run"""
+    last_key, rows_done, completed = (None, 0, False) if restart else load_checkpoint(conn, job)
+    if completed:
+        logger.info(f"Backfill {job.name} already completed ({rows_done} rows updated)")
+        return 0
+
+    started = time.monotonic()
+    scanned = 0
+    updated = 0
+
+    while True:
+        chunk_started = time.monotonic()
+        cursor = conn.cursor()
+        try:
+            # Short write transaction per chunk so the bot's writers only wait briefly. The
+            # read is inside it too, so no profile update lands between reading and writing
+            cursor.execute('BEGIN IMMEDIATE')
+            # -1 sorts before every user/message id, so a fresh job starts at the beginning
+            rows = cursor.execute(
+                job.select_sql, (last_key if last_key is not None else -1, chunk_size)
+            ).fetchall()
+            params = [p for p in (job.transform(row) for row in rows) if p is not None]
+            if params:
+                cursor.executemany(job.update_sql, params)
+            if rows:
+                last_key = rows[-1][0]
+            rows_done += len(params)
+            _save_checkpoint(cursor, job, last_key, rows_done, completed=not rows)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+        if not rows:
+            break
+
+        scanned += len(rows)
+        updated += len(params)
+        elapsed = time.monotonic() - started
+        logger.info(
+            f"Backfill {job.name}: scanned {scanned}, updated {updated}, "
+            f"last {job.key}={last_key}, {scanned / elapsed if elapsed else 0:.0f} rows/sec"
+        )
+
+        # Throttle to the target rate
+        if rows_per_sec > 0:
+            pause = len(rows) / rows_per_sec - (time.monotonic() - chunk_started)
+            if pause > 0:
+                time.sleep(pause)
+
+    elapsed = time.monotonic() - started
+    logger.info(
+        f"Backfill {job.name} completed: scanned {scanned}, updated {updated} in {elapsed:.1f}s "
+        f"({scanned / elapsed if elapsed else 0:.0f} rows/sec)"
+    )
+    return updated
+
+
+def connect(db_path: str = DATABASE_PATH) -> sqlite3.Connection:
+    """Connection that shares the database politely with a running bot"""
+    conn = sqlite3.connect(db_path, timeout=DB_BUSY_TIMEOUT)
+    conn.execute('PRAGMA journal_mode = WAL')
+    return conn
+
+
+if __name__ == '__main__':
+    logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
+
+    parser = argparse.ArgumentParser(description='Run an online backfill job')
+    parser.add_argument('job', nargs='?', choices=sorted(JOBS), help='job to run; omit to list jobs')
+    parser.add_argument('--chunk', type=int, default=BACKFILL_CHUNK_SIZE, help='rows per transaction')
+    parser.add_argument('--rate', type=float, default=BACKFILL_ROWS_PER_SEC, help='target rows/sec, 0 for unthrottled')
+    parser.add_argument('--restart', action='store_true', help='ignore the saved checkpoint')
+    args = parser.parse_args()
+
+    conn = connect()
+    try:
+        migrate(conn)
+        if not args.job:
+            for name, job in JOBS.items():
+                last_key, rows_done, completed = load_checkpoint(conn, job)
+                state = 'completed' if completed else f'at {job.key}={last_key}' if last_key is not None else 'not started'
+                print(f"{name}: {state}, {rows_done} rows updated")
+        else:
+            run_backfill(conn, JOBS[args.job], chunk_size=args.chunk, rows_per_sec=args.rate, restart=args.restart)
+    finally:
+        conn.close()
@@ -1,12 +1,36 @@
 import logging
-import sqlite3
 import os
-from datetime import datetime, timedelta
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, ReplyKeyboardRemove
+from datetime import datetime, timedelta, timezone
+from telegram import Bot, Update, InlineKeyboardButton, InlineKeyboardMarkup, ReplyKeyboardRemove
 from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes, CallbackQueryHandler
-from telegram.error import BadRequest
+from telegram.error import BadRequest, Forbidden, TelegramError
 import asyncio
-from typing import Dict, List, Optional
+import signal
+import time
+from typing import Dict, List, Optional, Tuple
+from database import ConnectionPool
+from journal import MessageJournal
+from caches import LRUCache, PremiumCache, MISSING, parse_timestamp
+from premium_sweeper import PremiumSweeper
+from update_processor import KeyedUpdateProcessor
+from webhook import WebhookServer
+from broadcast import BroadcastEngine, BroadcastStore
+from http_pools import PooledRequest, INTERACTIVE, BULK as BULK_POOL
+from outbound import OutboundScheduler, RELAY as RELAY_LANE, LIFECYCLE, BULK
+from relay import RelayQueue, Delivery, media_of
+from ingress import IngressQueue, ShedNotifier, RELAY, MATCHING, MENU
+from matchmaking import MatchPool, WaitingQueue, eligible_segments, plan_pairs, PREMIUM, FREE
+from config import (
+    PROFILE_CACHE_SIZE, PROFILE_CACHE_TTL, PREMIUM_EXPIRY_NOTIFY,
+    MATCH_BATCH_MODE, MATCH_BATCH_INTERVAL_MS, MATCH_CLAIM_ATTEMPTS,
+    INGRESS_SHED_NOTICE_INTERVAL,
+    HTTP_INTERACTIVE_POOL_SIZE, HTTP_INTERACTIVE_CONNECT_TIMEOUT, HTTP_INTERACTIVE_READ_TIMEOUT,
+    HTTP_INTERACTIVE_WRITE_TIMEOUT, HTTP_INTERACTIVE_POOL_TIMEOUT,
+    HTTP_BULK_POOL_SIZE, HTTP_BULK_CONNECT_TIMEOUT, HTTP_BULK_READ_TIMEOUT,
+    HTTP_BULK_WRITE_TIMEOUT, HTTP_BULK_POOL_TIMEOUT,
+)
+from schema import audit_query_plans
+from migrations import migrate
 
 # Configure logging
 logging.basicConfig(
@@ -18,90 +42,160 @@ logger = logging.getLogger(__name__)
 # Database setup
 DB_PATH = 'dating_bot.db'
 
+# Media relayed to chat partners with copy_message
+RELAY_MEDIA = (
+    filters.PHOTO | filters.VIDEO | filters.ANIMATION | filters.VOICE | filters.VIDEO_NOTE
+    | filters.AUDIO | filters.Document.ALL | filters.Sticker.ALL
+)
+
+# Commands that get matching priority at ingress; other commands are menus
+MATCHING_COMMANDS = {'findmatch', 'search', 'stopchat', 'activechat'}
+
+class ChatSession:
+    """In-memory record of an active chat, shared by both participants"""
+    def __init__(self, session_id: int, user1_id: int, user2_id: int):
+        self.session_id = session_id
+        self.user1_id = user1_id
+        self.user2_id = user2_id
+        self.started_at = datetime.now()
+        self.message_count = 0
+
 class DatingBot:
     def __init__(self, token: str):
         self.token = token
-        self.application = Application.builder().token(token).build()
+        # Different users run in parallel; one user's (or chat pair's) updates stay in order
+        self.update_processor = KeyedUpdateProcessor(self.update_lock_keys)
+        # Relay first, then matching, then menus; low priorities are shed under overload
+        self.ingress = IngressQueue(
+            self.update_class, ShedNotifier(self.send_busy_notice, INGRESS_SHED_NOTICE_INTERVAL)
+        )
+        # Separate connection pools, so bulk sends can't hold every connection relay needs
+        self.interactive_request = PooledRequest(
+            INTERACTIVE, HTTP_INTERACTIVE_POOL_SIZE, HTTP_INTERACTIVE_CONNECT_TIMEOUT,
+            HTTP_INTERACTIVE_READ_TIMEOUT, HTTP_INTERACTIVE_WRITE_TIMEOUT, HTTP_INTERACTIVE_POOL_TIMEOUT
+        )
+        self.bulk_request = PooledRequest(
+            BULK_POOL, HTTP_BULK_POOL_SIZE, HTTP_BULK_CONNECT_TIMEOUT,
+            HTTP_BULK_READ_TIMEOUT, HTTP_BULK_WRITE_TIMEOUT, HTTP_BULK_POOL_TIMEOUT
+        )
+        self.bulk_bot = Bot(token, request=self.bulk_request)  # Broadcasts and expiry notices
+        self.application = (
+            Application.builder()
+            .token(token)
+            .request(self.interactive_request)
+            .update_queue(self.ingress)
+            .concurrent_updates(self.update_processor)
+            .post_init(self.on_startup)
+            .post_stop(self.on_stop)
+            .post_shutdown(self.on_shutdown)
+            .build()
+        )
+        self.db = ConnectionPool(DB_PATH)
+        self.journal = MessageJournal(lambda rows: self.db.run(self.save_messages, rows))
+        self.profile_cache = LRUCache(PROFILE_CACHE_SIZE, PROFILE_CACHE_TTL)  # user_id: users row
+        self.premium_cache = PremiumCache()  # Every premium user's expiry
+        self.premium_sweeper = PremiumSweeper(self.db, self.premium_cache, self.on_premium_expired)
         self.active_chats: Dict[int, int] = {}  # user_id: partner_id
-        self.pending_matches: List[int] = []  # Users waiting for matches
+        self.active_sessions: Dict[int, ChatSession] = {}  # user_id: session record
+        self.match_pool = MatchPool()  # Active users not in a chat
+        self.waiting_queue = WaitingQueue()  # Users waiting for matches
+        self.batch_matching_task: Optional[asyncio.Task] = None
+        self.outbound = OutboundScheduler()  # Relay > chat notices > broadcasts, within Telegram's limits
+        self.relay = RelayQueue(  # Chat messages in order, retried until delivered or dead-lettered
+            self.outbound, self.on_relay_delivered, self.on_relay_dead, self.on_partner_gone
+        )
+        self.broadcasts = BroadcastEngine(
+            self.bulk_bot, self.outbound, BroadcastStore(self.db), self.broadcast_recipients
+        )
         self.init_database()
         self.setup_handlers()
 
     def init_database(self):
-        """Initialize the database with required tables"""
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        
-        # Users table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS users (
-                user_id INTEGER PRIMARY KEY,
-                username TEXT,
-                first_name TEXT,
-                gender TEXT,
-                age TEXT,
-                favorite_game TEXT,
-                favorite_movie TEXT,
-                favorite_music TEXT,
-                interests TEXT,
-                photo_url TEXT,
-                is_premium BOOLEAN DEFAULT FALSE,
-                premium_expires DATETIME,
-                is_active BOOLEAN DEFAULT TRUE,
-                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                last_active DATETIME DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        # Chat sessions table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS chat_sessions (
-                session_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user1_id INTEGER,
-                user2_id INTEGER,
-                started_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                ended_at DATETIME,
-                is_active BOOLEAN DEFAULT TRUE,
-                FOREIGN KEY (user1_id) REFERENCES users (user_id),
-                FOREIGN KEY (user2_id) REFERENCES users (user_id)
-            )
-        ''')
-        
-        # Messages table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS messages (
-                message_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                session_id INTEGER,
-                sender_id INTEGER,
-                message_text TEXT,
-                sent_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (session_id) REFERENCES chat_sessions (session_id),
-                FOREIGN KEY (sender_id) REFERENCES users (user_id)
+        """Bring the database schema up to date"""
+        with self.db.connection() as conn:
+            # No-op when the schema is already current
+            migrate(conn)
+            # Every boot: catch a query that regressed to a full table scan or a dropped index
+            audit_query_plans(conn.cursor())
+            
+            # Premium entitlements, so is_user_premium never needs the database
+            self.premium_cache.load(conn.execute(
+                'SELECT user_id, premium_expires FROM users WHERE is_premium = TRUE'
+            ).fetchall())
+            
+            # Chats only live in memory, so sessions left open by a previous run are over
+            conn.execute(
+                'UPDATE chat_sessions SET is_active = FALSE, ended_at = ? WHERE is_active = TRUE',
+                (datetime.now(),)
             )
-        ''')
-        
-        # Subscription plans table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS subscription_plans (
-                plan_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                plan_name TEXT,
-                duration_days INTEGER,
-                price REAL,
-                description TEXT
+            self.match_pool.load(conn.execute(
+                'SELECT user_id, gender FROM users WHERE is_active = TRUE'
+            ).fetchall())
+
+    async def on_startup(self, application: Application):
+        """Start background workers once the event loop is running"""
+        await self.bulk_bot.initialize()
+        self.outbound.start()
+        self.journal.start()
+        self.premium_sweeper.start()
+        if MATCH_BATCH_MODE:
+            self.batch_matching_task = asyncio.create_task(self.batch_matching_loop())
+        # Broadcasts interrupted by a restart pick up from their last checkpoint
+        await self.broadcasts.resume_all()
+
+    async def on_stop(self, application: Application):
+        """Drain relay and outbound sends while the bot's HTTP client is still open"""
+        if self.batch_matching_task:
+            self.batch_matching_task.cancel()
+        await self.relay.stop()
+        await self.broadcasts.stop()
+        await self.premium_sweeper.stop()
+        await self.outbound.stop()
+
+    async def on_shutdown(self, application: Application):
+        """Flush queued messages and release database connections when the bot stops"""
+        await self.bulk_bot.shutdown()
+        await self.journal.stop()
+        self.db.close()
+
+    def update_lock_keys(self, update: object) -> Tuple[int, ...]:
+        """Keys an update is serialized on: its user, plus the partner while in a chat"""
+        user = getattr(update, 'effective_user', None)
+        if user is None:
+            return ()
+        partner_id = self.active_chats.get(user.id)
+        if partner_id is None:
+            return (user.id,)
+        return (user.id, partner_id)
+
+    def update_class(self, update: object) -> Optional[int]:
+        """Ingress priority of an update; None for the application's own control objects"""
+        if not isinstance(update, Update):
+            return None
+        user = update.effective_user
+        if user and user.id in self.ADMIN_IDS:
+            return MATCHING
+        message = update.message
+        if message is None:
+            return MENU  # Inline button presses
+        text = message.text or ''
+        if text.startswith('/'):
+            command = text[1:].split('@')[0].split(maxsplit=1)[0].lower() if text[1:].strip() else ''
+            return MATCHING if command in MATCHING_COMMANDS else MENU
+        if user and user.id in self.active_chats:
+            return RELAY
+        return MATCHING  # Profile answers
+
+    async def send_busy_notice(self, chat_id: int):
+        """Canned reply for an update shed under overload"""
+        try:
+            await self.outbound.send_message(
+                LIFECYCLE, self.application.bot, chat_id,
+                text="⏳ The bot is very busy right now. Please try again in a moment.",
+                reply_markup=ReplyKeyboardRemove()
             )
-        ''')
-        
-        # Insert default subscription plans
-        cursor.execute('''
-            INSERT OR IGNORE INTO subscription_plans (plan_id, plan_name, duration_days, price, description)
-            VALUES 
-                (1, 'Weekly Premium', 7, 4.99, 'Chat with all users for 1 week'),
-                (2, 'Monthly Premium', 30, 14.99, 'Chat with all users for 1 month'),
-                (3, 'Yearly Premium', 365, 99.99, 'Chat with all users for 1 year')
-        ''')
-        
-        conn.commit()
-        conn.close()
+        except TelegramError as e:
+            logger.warning(f"Busy notice to {chat_id} failed: {e}")
 
     def setup_handlers(self):
         """Set up command and message handlers"""
@@ -120,10 +214,14 @@ class DatingBot:
         self.application.add_handler(CommandHandler("admin", self.admin_command))
         self.application.add_handler(CommandHandler("stats", self.admin_stats))
         self.application.add_handler(CommandHandler("broadcast", self.admin_broadcast))
+        self.application.add_handler(CommandHandler("broadcasts", self.admin_broadcasts))
+        self.application.add_handler(CommandHandler("pausebroadcast", self.admin_pause_broadcast))
+        self.application.add_handler(CommandHandler("resumebroadcast", self.admin_resume_broadcast))
+        self.application.add_handler(CommandHandler("cancelbroadcast", self.admin_cancel_broadcast))
         
         self.application.add_handler(CallbackQueryHandler(self.handle_callback))
         self.application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, self.handle_message))
-        self.application.add_handler(MessageHandler(filters.PHOTO, self.handle_photo))
+        self.application.add_handler(MessageHandler(RELAY_MEDIA, self.handle_media))
 
     async def start_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle /start command"""
@@ -131,7 +229,7 @@ class DatingBot:
         user_id = user.id
         
         # Check if user exists in database
-        if not self.get_user(user_id):
+        if not await self.load_user(user_id):
             # New user registration
             await update.message.reply_text(
                 f"🌹 Welcome to Anonymous Dating Bot! 🌹\n\n"
@@ -176,27 +274,69 @@ class DatingBot:
         message_text = update.message.text
         
         # Check if user is in an active chat
-        if user_id in self.active_chats:
+        session = self.active_sessions.get(user_id)
+        if session and user_id in self.active_chats:
             partner_id = self.active_chats[user_id]
-            try:
-                await context.bot.send_message(
-                    chat_id=partner_id,
-                    text=f"💬 Anonymous: {message_text}"
-                )
-                # Save message to database
-                self.save_message(user_id, partner_id, message_text)
-            except BadRequest:
-                # Partner blocked the bot or chat is unavailable
-                await update.message.reply_text(
-                    "❌ Your chat partner is no longer available. Starting new search..."
-                )
-                await self.end_chat(user_id, partner_id)
-                await self.search_for_match(update, context)
+            # Delivered in the background, so retries don't hold up this chat's next updates
+            self.relay.submit(Delivery(
+                session.session_id, user_id, partner_id, message_text, context.bot, (update, context)
+            ))
             return
         
         # Handle profile creation steps
         await self.handle_profile_creation(update, context, message_text)
 
+    async def on_relay_delivered(self, delivery: Delivery):
+        """Count relayed messages and queue them for batched saving, one row each even when coalesced"""
+        session = self.active_sessions.get(delivery.sender_id)
+        if session and session.session_id == delivery.session_id:
+            session.message_count += len(delivery.lines)
+        sent_at = datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+        media = delivery.media
+        if media:
+            await self.journal.append((
+                delivery.session_id, delivery.sender_id, media.caption, sent_at,
+                media.kind, media.file_id, media.file_unique_id, media.file_size
+            ))
+            return
+        for line in delivery.lines:
+            await self.journal.append((
+                delivery.session_id, delivery.sender_id, line, sent_at, None, None, None, None
+            ))
+
+    async def on_relay_dead(self, delivery: Delivery):
+        """Keep a message that could not be relayed and let the sender know"""
+        media = delivery.media
+        await self.db.aexecute('''
+            INSERT INTO relay_dead_letters
+            (session_id, sender_id, recipient_id, message_text, attempts, error, media_type, media_file_id)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (delivery.session_id, delivery.sender_id, delivery.recipient_id, delivery.text,
+              delivery.attempts, str(delivery.error),
+              media.kind if media else None, media.file_id if media else None))
+        # Blocked partners are handled by on_partner_gone; ended chats and shutdown need no notice
+        if delivery.ended:
+            return
+        if isinstance(delivery.error, TelegramError) and not isinstance(delivery.error, Forbidden):
+            await self.outbound.send_message(
+                LIFECYCLE, delivery.bot, delivery.sender_id,
+                text="⚠️ Your last message couldn't be delivered. Please try sending it again."
+            )
+
+    async def on_partner_gone(self, delivery: Delivery):
+        """The partner blocked the bot: end the chat and search again for the sender"""
+        # Not an update, so take the pair's update lock to stay in order with their handlers
+        async with self.update_processor.hold((delivery.sender_id, delivery.recipient_id)):
+            session = self.active_sessions.get(delivery.sender_id)
+            if not session or session.session_id != delivery.session_id:
+                return  # That chat is already over
+            update, context = delivery.origin
+            await update.message.reply_text(
+                "❌ Your chat partner is no longer available. Starting new search..."
+            )
+            await self.end_chat(delivery.sender_id, delivery.recipient_id)
+            await self.search_for_match(update, context)
+
     async def create_profile_start(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Start profile creation process"""
         context.user_data['creating_profile'] = True
@@ -306,29 +446,43 @@ class DatingBot:
             else:
                 await update.message.reply_text("Please tell us about your favorite music:")
 
-    async def handle_photo(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        """Handle photo uploads - not needed anymore"""
-        pass
+    async def handle_media(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Relay photos, videos, voice notes, stickers and files to the chat partner"""
+        user_id = update.effective_user.id
+        media = media_of(update.message)
+        session = self.active_sessions.get(user_id)
+        # Outside a chat media isn't needed (profiles have no photos)
+        if session is None or user_id not in self.active_chats or media is None:
+            return
+        
+        partner_id = self.active_chats[user_id]
+        self.relay.submit(Delivery(
+            session.session_id, user_id, partner_id, media.caption or '', context.bot,
+            (update, context), media=media
+        ))
 
     async def finalize_profile(self, update_or_query, context: ContextTypes.DEFAULT_TYPE):
         """Finalize profile creation"""
         user_data = context.user_data
         user = update_or_query.effective_user if hasattr(update_or_query, 'effective_user') else update_or_query.from_user
         
-        # Save user to database
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            INSERT OR REPLACE INTO users 
-            (user_id, username, first_name, gender, age, favorite_game, favorite_movie, favorite_music, interests, photo_url, last_active)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        # Save user to database; an existing user keeps their premium, activity and join date
+        await self.db.aexecute('''
+            INSERT INTO users 
+            (user_id, username, first_name, gender, age, age_years, favorite_game, favorite_movie, favorite_music, interests, photo_url, last_active)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(user_id) DO UPDATE SET
+                username = excluded.username, first_name = excluded.first_name, gender = excluded.gender,
+                age = excluded.age, age_years = excluded.age_years, favorite_game = excluded.favorite_game,
+                favorite_movie = excluded.favorite_movie, favorite_music = excluded.favorite_music,
+                interests = excluded.interests, photo_url = excluded.photo_url, last_active = excluded.last_active
         ''', (
             user.id,
             user.username,
             user_data.get('name', user.first_name),
             user_data.get('gender'),
             user_data.get('age'),
+            user_data.get('age') if isinstance(user_data.get('age'), int) else None,  # numeric age
             user_data.get('favorite_game'),
             user_data.get('favorite_movie'),
             user_data.get('favorite_music'),
@@ -336,9 +490,9 @@ class DatingBot:
             '',  # Empty photo_url
             datetime.now()
         ))
-        
-        conn.commit()
-        conn.close()
+        self.profile_cache.invalidate(user.id)
+        await self.db.run(self.refresh_premium, user.id)
+        self.match_pool.register(user.id, user_data.get('gender'))
         
         # Clear profile creation data
         context.user_data.clear()
@@ -374,106 +528,88 @@ class DatingBot:
         user_id = update.effective_user.id
         
         # Check if user has profile
-        if not self.get_user(user_id):
+        user_data = await self.load_user(user_id)
+        if not user_data:
             await update.message.reply_text(
                 "❌ Please create your profile first using /createprofile.",
                 reply_markup=ReplyKeyboardRemove()
             )
             return
         
-        # Check if already in chat
-        if user_id in self.active_chats:
+        # Check if already in chat (or being connected to one)
+        if user_id in self.active_chats or self.match_pool.is_busy(user_id):
             await update.message.reply_text(
                 "❌ You're already in a chat! Use /stopchat to end it first.",
                 reply_markup=ReplyKeyboardRemove()
             )
             return
         
-        user_data = self.get_user(user_id)
         user_gender = user_data[3]  # gender column
+        is_premium = self.is_user_premium(user_id)
+        
+        self.waiting_queue.cancel(user_id)
+        if not MATCH_BATCH_MODE:
+            # A concurrent search can claim the same partner first, so try a few candidates
+            for _ in range(MATCH_CLAIM_ATTEMPTS):
+                # Someone already waiting goes first, otherwise pick from everyone available
+                partner_id = self.waiting_queue.next_partner(user_id, user_gender, is_premium)
+                if not partner_id or not self.match_pool.is_available(partner_id):
+                    partner_id = self.find_match(user_id, user_gender)
+                if not partner_id:
+                    break
+                if await self.start_chat(user_id, partner_id, context):
+                    return
+                if self.match_pool.is_busy(user_id):
+                    # Someone else's search connected this user meanwhile
+                    return
+        
+        # Wait for the next compatible user to search (or the next batch round)
+        self.waiting_queue.enqueue(user_id, user_gender, is_premium)
         
-        # Find potential matches
-        potential_match = self.find_match(user_id, user_gender)
-        
-        if potential_match:
-            # Start chat
-            partner_id = potential_match[0]
-            await self.start_chat(user_id, partner_id, context)
-        else:
-            # Add to pending matches
-            if user_id not in self.pending_matches:
-                self.pending_matches.append(user_id)
-            
-            await update.message.reply_text(
-                "🔍 Searching for a match...\n\n"
-                "You'll be notified when someone is found!\n"
-                "You can continue using other features while waiting.",
-                reply_markup=ReplyKeyboardRemove()
-            )
+        await update.message.reply_text(
+            "🔍 Searching for a match...\n\n"
+            "You'll be notified when someone is found!\n"
+            "You can continue using other features while waiting.",
+            reply_markup=ReplyKeyboardRemove()
+        )
 
-    def find_match(self, user_id: int, user_gender: str) -> Optional[tuple]:
+    def find_match(self, user_id: int, user_gender: str) -> Optional[int]:
         """Find a potential match for the user"""
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        
-        # For premium users, they can chat with anyone
-        # For non-premium users, males can only chat with males, females need premium to chat
-        user_premium = self.is_user_premium(user_id)
-        
-        if user_premium:
-            # Premium users can match with anyone who is not in active chat
-            cursor.execute('''
-                SELECT user_id FROM users 
-                WHERE user_id != ? AND is_active = TRUE
-                AND user_id NOT IN (SELECT user1_id FROM chat_sessions WHERE is_active = TRUE)
-                AND user_id NOT IN (SELECT user2_id FROM chat_sessions WHERE is_active = TRUE)
-                ORDER BY RANDOM()
-                LIMIT 1
-            ''', (user_id,))
-        else:
-            if user_gender == 'Male':
-                # Non-premium males can only match with other males
-                cursor.execute('''
-                    SELECT user_id FROM users 
-                    WHERE user_id != ? AND gender = 'Male' AND is_active = TRUE
-                    AND user_id NOT IN (SELECT user1_id FROM chat_sessions WHERE is_active = TRUE)
-                    AND user_id NOT IN (SELECT user2_id FROM chat_sessions WHERE is_active = TRUE)
-                    ORDER BY RANDOM()
-                    LIMIT 1
-                ''', (user_id,))
-            else:
-                # Non-premium females cannot start chats (need premium)
-                conn.close()
-                return None
-        
-        result = cursor.fetchone()
-        conn.close()
-        return result
-
-    async def start_chat(self, user1_id: int, user2_id: int, context: ContextTypes.DEFAULT_TYPE):
-        """Start a chat session between two users"""
-        # Create chat session in database
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            INSERT INTO chat_sessions (user1_id, user2_id)
-            VALUES (?, ?)
-        ''', (user1_id, user2_id))
-        
-        session_id = cursor.lastrowid
-        conn.commit()
-        conn.close()
-        
-        # Update active chats
-        self.active_chats[user1_id] = user2_id
-        self.active_chats[user2_id] = user1_id
-        
-        # Remove from pending matches
-        if user1_id in self.pending_matches:
-            self.pending_matches.remove(user1_id)
-        if user2_id in self.pending_matches:
-            self.pending_matches.remove(user2_id)
+        # Premium users can chat with anyone; free males only with males; free females need premium
+        segments = eligible_segments(user_gender, self.is_user_premium(user_id))
+        return self.match_pool.pick(user_id, segments)
+
+    async def start_chat(self, user1_id: int, user2_id: int, context: ContextTypes.DEFAULT_TYPE) -> bool:
+        """Start a chat session between two users; False if either was already taken"""
+        return bool(await self.start_chats([(user1_id, user2_id)], context.bot))
+
+    async def start_chats(self, pairs: List[Tuple[int, int]], bot) -> List[Tuple[int, int]]:
+        """Start chat sessions for several pairs with a single database transaction"""
+        # Claim both users before the first await so no other search can book them
+        pairs = [pair for pair in pairs if self.match_pool.claim_pair(*pair)]
+        if not pairs:
+            return []
+        
+        # Create chat sessions in database
+        try:
+            session_ids = await self.db.run(self.create_sessions, pairs)
+        except Exception:
+            for user1_id, user2_id in pairs:
+                self.match_pool.release(user1_id)
+                self.match_pool.release(user2_id)
+            raise
+        
+        for (user1_id, user2_id), session_id in zip(pairs, session_ids):
+            # Update active chats
+            session = ChatSession(session_id, user1_id, user2_id)
+            self.active_chats[user1_id] = user2_id
+            self.active_chats[user2_id] = user1_id
+            self.active_sessions[user1_id] = session
+            self.active_sessions[user2_id] = session
+            
+            # Remove from waiting queue
+            self.waiting_queue.cancel(user1_id, matched=True)
+            self.waiting_queue.cancel(user2_id, matched=True)
         
         # Notify both users
         chat_message = (
@@ -483,17 +619,89 @@ class DatingBot:
             "🔹 Be respectful and have fun! 😊"
         )
         
-        try:
-            await context.bot.send_message(chat_id=user1_id, text=chat_message, reply_markup=ReplyKeyboardRemove())
-            await context.bot.send_message(chat_id=user2_id, text=chat_message, reply_markup=ReplyKeyboardRemove())
-        except BadRequest as e:
-            logger.error(f"Error starting chat: {e}")
+        results = await asyncio.gather(*[
+            self.outbound.send_message(LIFECYCLE, bot, user_id, text=chat_message, reply_markup=ReplyKeyboardRemove())
+            for pair in pairs for user_id in pair
+        ], return_exceptions=True)
+        for result in results:
+            if isinstance(result, BadRequest):
+                logger.error(f"Error starting chat: {result}")
+            elif isinstance(result, Exception):
+                raise result
+        return pairs
+
+    def create_sessions(self, pairs: List[Tuple[int, int]]) -> List[int]:
+        """Insert a chat_sessions row per pair in one transaction and return their ids"""
+        session_ids = []
+        with self.db.connection() as conn:
+            cursor = conn.cursor()
+            for user1_id, user2_id in pairs:
+                cursor.execute('''
+                    INSERT INTO chat_sessions (user1_id, user2_id)
+                    VALUES (?, ?)
+                ''', (user1_id, user2_id))
+                session_ids.append(cursor.lastrowid)
+        return session_ids
+
+    async def batch_matching_loop(self):
+        """Run a matching round every MATCH_BATCH_INTERVAL_MS (batch matching mode)"""
+        while True:
+            await asyncio.sleep(MATCH_BATCH_INTERVAL_MS / 1000)
+            try:
+                await self.run_matching_round()
+            except Exception as e:
+                logger.error(f"Batch matching round failed: {e}")
+
+    async def run_matching_round(self):
+        """Pair the whole waiting pool at once and start every chat in one pass"""
+        waiters = self.waiting_queue.snapshot()
+        pairs = []
+        if len(waiters) >= 2:
+            pairs = await self.db.run(self.plan_matching_round, waiters)
+        
+        # Drop pairs invalidated while the round was being planned; start_chats
+        # claims both users, so anyone taken by a direct search is skipped there
+        pairs = [
+            (user1_id, user2_id) for user1_id, user2_id in pairs
+            if user1_id in self.waiting_queue and user2_id in self.waiting_queue
+        ]
+        paired = {user_id for pair in pairs for user_id in pair}
+        
+        # Anyone left past the maximum wait takes a partner from everyone available
+        for user_id in self.waiting_queue.overdue():
+            if user_id in paired:
+                continue
+            partner_id = self.find_match(user_id, self.match_pool.gender_of(user_id))
+            if partner_id and partner_id not in paired:
+                pairs.append((user_id, partner_id))
+                paired.update((user_id, partner_id))
+        
+        if pairs:
+            await self.start_chats(pairs, self.application.bot)
+
+    def plan_matching_round(self, waiters: List[tuple]) -> List[Tuple[int, int]]:
+        """Compute the best pairing for a waiting pool snapshot"""
+        profiles = {
+            user_id: self.db.fetchone(
+                'SELECT favorite_game, favorite_movie, favorite_music, age_years FROM users WHERE user_id = ?',
+                (user_id,)
+            )
+            for user_id, _, _ in waiters
+        }
+        return plan_pairs(waiters, profiles, time.monotonic(), self.waiting_queue.max_wait)
 
     async def stop_chat_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle /stopchat command"""
         user_id = update.effective_user.id
         
         if user_id not in self.active_chats:
+            if self.waiting_queue.cancel(user_id):
+                await update.message.reply_text(
+                    "🔍 Search cancelled.\n\nUse /findmatch to search again!",
+                    reply_markup=ReplyKeyboardRemove()
+                )
+                return
+            
             await update.message.reply_text(
                 "❌ You're not in any active chat.",
                 reply_markup=ReplyKeyboardRemove()
@@ -504,8 +712,8 @@ class DatingBot:
         await self.end_chat(user_id, partner_id)
         
         try:
-            await context.bot.send_message(
-                chat_id=partner_id,
+            await self.outbound.send_message(
+                LIFECYCLE, context.bot, partner_id,
                 text="💔 Your chat partner has left the conversation.\n\nUse /findmatch to start a new chat!",
                 reply_markup=ReplyKeyboardRemove()
             )
@@ -519,32 +727,39 @@ class DatingBot:
 
     async def end_chat(self, user1_id: int, user2_id: int):
         """End a chat session"""
-        # Update database
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            UPDATE chat_sessions 
-            SET is_active = FALSE, ended_at = ?
-            WHERE (user1_id = ? AND user2_id = ?) OR (user1_id = ? AND user2_id = ?)
-            AND is_active = TRUE
-        ''', (datetime.now(), user1_id, user2_id, user2_id, user1_id))
+        # Both maps change before any await, so no handler sees a half-ended chat
+        session = self.active_sessions.pop(user1_id, None)
+        self.active_sessions.pop(user2_id, None)
+        self.active_chats.pop(user1_id, None)
+        self.active_chats.pop(user2_id, None)
+        if session:
+            # Messages already sent in this chat go out before whatever comes next
+            await self.relay.end_session(session.session_id)
         
-        conn.commit()
-        conn.close()
+        self.match_pool.release(user1_id)
+        self.match_pool.release(user2_id)
         
-        # Remove from active chats
-        if user1_id in self.active_chats:
-            del self.active_chats[user1_id]
-        if user2_id in self.active_chats:
-            del self.active_chats[user2_id]
+        # Update database
+        if session:
+            await self.db.aexecute('''
+                UPDATE chat_sessions 
+                SET is_active = FALSE, ended_at = ?
+                WHERE session_id = ?
+            ''', (datetime.now(), session.session_id))
+        else:
+            await self.db.aexecute('''
+                UPDATE chat_sessions 
+                SET is_active = FALSE, ended_at = ?
+                WHERE ((user1_id = ? AND user2_id = ?) OR (user1_id = ? AND user2_id = ?))
+                AND is_active = TRUE
+            ''', (datetime.now(), user1_id, user2_id, user2_id, user1_id))
 
     async def premium_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle /premium command"""
         user_id = update.effective_user.id
         
         if self.is_user_premium(user_id):
-            premium_data = self.get_premium_info(user_id)
+            premium_data = await self.db.run(self.get_premium_info, user_id)
             await update.message.reply_text(
                 f"💎 You have Premium access!\n\n"
                 f"Expires: {premium_data[1]}\n\n"
@@ -577,11 +792,7 @@ class DatingBot:
         user_id = query.from_user.id
         
         # Get plan details
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        cursor.execute('SELECT * FROM subscription_plans WHERE plan_id = ?', (plan_id,))
-        plan = cursor.fetchone()
-        conn.close()
+        plan = await self.db.afetchone('SELECT * FROM subscription_plans WHERE plan_id = ?', (plan_id,))
         
         if not plan:
             await query.edit_message_text("❌ Invalid plan selected.")
@@ -598,32 +809,62 @@ class DatingBot:
         )
         
         # Activate premium
-        self.activate_premium(user_id, plan[2])
+        await self.db.run(self.activate_premium, user_id, plan[2])
 
     def activate_premium(self, user_id: int, duration_days: int):
         """Activate premium for a user"""
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        
         expires_at = datetime.now() + timedelta(days=duration_days)
         
-        cursor.execute('''
+        self.db.execute('''
             UPDATE users 
             SET is_premium = TRUE, premium_expires = ?
             WHERE user_id = ?
         ''', (expires_at, user_id))
+        self.profile_cache.invalidate(user_id)
+        self.premium_cache.grant(user_id, expires_at.timestamp())
+        self.premium_sweeper.schedule(user_id, expires_at.timestamp())
+
+    def refresh_premium(self, user_id: int):
+        """Bring the premium cache and sweeper back in line with the user's row"""
+        info = self.get_premium_info(user_id)
+        if info and info[0] and info[1]:
+            expires_at = parse_timestamp(info[1])
+            self.premium_cache.grant(user_id, expires_at)
+            self.premium_sweeper.schedule(user_id, expires_at)
+        else:
+            self.premium_cache.revoke(user_id)
+
+    async def on_premium_expired(self, user_ids: List[int]):
+        """Refresh cached profiles and notify users whose premium just ran out"""
+        for user_id in user_ids:
+            self.profile_cache.invalidate(user_id)
+        
+        if not PREMIUM_EXPIRY_NOTIFY:
+            return
         
-        conn.commit()
-        conn.close()
+        results = await asyncio.gather(*[
+            self.outbound.send_message(
+                BULK, self.bulk_bot, user_id,
+                text="💎 Your Premium membership has expired.\n\nUse /premium to renew and keep chatting with everyone!",
+                reply_markup=ReplyKeyboardRemove()
+            )
+            for user_id in user_ids
+        ], return_exceptions=True)
+        for user_id, result in zip(user_ids, results):
+            if isinstance(result, Exception):
+                logger.warning(f"Could not notify {user_id} about premium expiry: {result}")
 
     async def show_active_chat_info(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Show active chat information"""
         user_id = update.effective_user.id
         
-        if user_id in self.active_chats:
-            partner_id = self.active_chats[user_id]
+        session = self.active_sessions.get(user_id)
+        if session and user_id in self.active_chats:
+            minutes = int((datetime.now() - session.started_at).total_seconds() // 60)
             await update.message.reply_text(
                 "💬 You're currently in a chat!\n\n"
+                f"⏱ Duration: {minutes} min\n"
+                f"✉️ Messages: {session.message_count}\n\n"
                 "Send any message and it will be forwarded to your chat partner.\n"
                 "Use /stopchat to end the conversation.",
                 reply_markup=ReplyKeyboardRemove()
@@ -638,7 +879,7 @@ class DatingBot:
     async def show_profile(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Show user profile"""
         user_id = update.effective_user.id
-        user_data = self.get_user(user_id)
+        user_data = await self.load_user(user_id)
         
         if not user_data:
             await update.message.reply_text(
@@ -709,6 +950,8 @@ class DatingBot:
             "Available Commands:\n"
             "/stats - View bot statistics\n"
             "/broadcast <message> - Send message to all users\n"
+            "/broadcasts - Recent broadcasts and their progress\n"
+            "/pausebroadcast, /resumebroadcast, /cancelbroadcast <id> - Control a broadcast\n"
             "/admin - Show this panel\n\n"
             "Database Management:\n"
             "• Total users: Use /stats\n"
@@ -729,29 +972,8 @@ class DatingBot:
             )
             return
         
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        
-        # Get statistics
-        cursor.execute('SELECT COUNT(*) FROM users')
-        total_users = cursor.fetchone()[0]
-        
-        cursor.execute('SELECT COUNT(*) FROM users WHERE is_premium = TRUE')
-        premium_users = cursor.fetchone()[0]
-        
-        cursor.execute('SELECT COUNT(*) FROM chat_sessions WHERE is_active = TRUE')
-        active_chats = cursor.fetchone()[0]
-        
-        cursor.execute('SELECT COUNT(*) FROM messages')
-        total_messages = cursor.fetchone()[0]
-        
-        cursor.execute('SELECT COUNT(*) FROM users WHERE gender = "Male"')
-        male_users = cursor.fetchone()[0]
-        
-        cursor.execute('SELECT COUNT(*) FROM users WHERE gender = "Female"')
-        female_users = cursor.fetchone()[0]
-        
-        conn.close()
+        total_users, premium_users, active_chats, total_messages, male_users, female_users = \
+            await self.db.run(self.get_stats)
         
         stats_text = (
             f"📊 Bot Statistics\n\n"
@@ -763,13 +985,60 @@ class DatingBot:
             f"💬 Activity:\n"
             f"• Active Chats: {active_chats}\n"
             f"• Total Messages: {total_messages}\n"
-            f"• Pending Matches: {len(self.pending_matches)}\n\n"
+            f"• Pending Matches: {len(self.waiting_queue)}\n"
+            f"• Wait (premium): {self.format_wait_stats(PREMIUM)}\n"
+            f"• Wait (free): {self.format_wait_stats(FREE)}\n"
+            f"• Profile Cache: {len(self.profile_cache)} cached, {self.profile_cache.hit_rate:.0%} hit rate\n\n"
+            f"⚙️ Load:\n"
+            f"{self.format_ingress_stats()}\n"
+            f"{self.format_outbound_stats()}\n"
+            f"• Relay: {self.relay.pending} pending, {self.relay.retried} retries, {self.relay.dead} dead-lettered, "
+            f"{self.relay.coalesced} coalesced\n"
+            f"{self.format_http_stats()}\n\n"
             f"💎 Revenue:\n"
             f"• Premium Rate: {(premium_users/total_users*100):.1f}%" if total_users > 0 else "• Premium Rate: 0%"
         )
         
         await update.message.reply_text(stats_text, reply_markup=ReplyKeyboardRemove())
 
+    def format_wait_stats(self, tier: str) -> str:
+        """One-line wait-time summary for a matching tier"""
+        stats = self.waiting_queue.stats[tier]
+        return (
+            f"{self.waiting_queue.waiting(tier)} waiting, {stats.matched} matched, "
+            f"avg {stats.average:.1f}s, p95 {stats.percentile(95):.1f}s"
+        )
+
+    def format_ingress_stats(self) -> str:
+        """Ingress queue depth and shed counts"""
+        depths = self.ingress.depths()
+        shed = self.ingress.shed_counts()
+        return (
+            f"• Ingress Queue: {sum(depths.values())} queued "
+            f"(relay {depths['relay']}, matching {depths['matching']}, menu {depths['menu']}), "
+            f"{self.ingress.in_flight} in flight, peak {self.ingress.max_depth}\n"
+            f"• Shed: {shed['matching']} matching, {shed['menu']} menu"
+        )
+
+    def format_outbound_stats(self) -> str:
+        """Per-lane depth and queued-to-sent latency of the outbound scheduler"""
+        lines = []
+        for lane in (RELAY_LANE, LIFECYCLE, BULK):
+            latency = self.outbound.latency[lane]
+            lines.append(
+                f"• Outbound {lane}: {self.outbound.depth(lane)} queued, {self.outbound.sent[lane]} sent, "
+                f"avg {latency.average:.2f}s, p95 {latency.percentile(95):.2f}s"
+            )
+        return "\n".join(lines)
+
+    def format_http_stats(self) -> str:
+        """Usage, connection reuse and pool timeouts of each HTTP connection pool"""
+        return "\n".join(
+            f"• HTTP {pool.name}: {pool.in_flight}/{pool.pool_size} in use (peak {pool.peak_in_flight}), "
+            f"{pool.requests} requests, {pool.reuse_rate:.0%} reused, {pool.pool_timeouts} pool timeouts"
+            for pool in (self.interactive_request, self.bulk_request)
+        )
+
     async def admin_broadcast(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Broadcast message to all users"""
         user_id = update.effective_user.id
@@ -792,97 +1061,146 @@ class DatingBot:
         
         broadcast_message = " ".join(context.args)
         
-        # Get all users
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        cursor.execute('SELECT user_id FROM users WHERE is_active = TRUE')
-        users = cursor.fetchall()
-        conn.close()
-        
-        success_count = 0
-        failed_count = 0
+        # Sends run in the background; the engine keeps a progress message up to date
+        total = (await self.db.afetchone('SELECT COUNT(*) FROM users WHERE is_active = TRUE'))[0]
+        await self.broadcasts.start(broadcast_message, update.effective_chat.id, total)
+
+    async def admin_broadcasts(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """List recent broadcasts"""
+        if update.effective_user.id not in self.ADMIN_IDS:
+            await update.message.reply_text(
+                "❌ You don't have admin access.",
+                reply_markup=ReplyKeyboardRemove()
+            )
+            return
         
-        for user_row in users:
-            user_id_to_send = user_row[0]
-            try:
-                await context.bot.send_message(
-                    chat_id=user_id_to_send,
-                    text=f"📢 Admin Announcement\n\n{broadcast_message}",
-                    reply_markup=ReplyKeyboardRemove()
-                )
-                success_count += 1
-            except Exception:
-                failed_count += 1
+        jobs = await self.broadcasts.store.recent()
+        if not jobs:
+            await update.message.reply_text("📢 No broadcasts yet.", reply_markup=ReplyKeyboardRemove())
+            return
         
+        lines = [
+            f"#{job_id} {status}: {sent} sent, {failed} failed of {total}"
+            for job_id, status, sent, failed, total in jobs
+        ]
         await update.message.reply_text(
-            f"📢 Broadcast Complete\n\n"
-            f"✅ Sent to: {success_count} users\n"
-            f"❌ Failed: {failed_count} users",
+            "📢 Recent Broadcasts\n\n" + "\n".join(lines),
             reply_markup=ReplyKeyboardRemove()
         )
 
-    def get_user(self, user_id: int) -> Optional[tuple]:
-        """Get user data from database"""
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        cursor.execute('SELECT * FROM users WHERE user_id = ?', (user_id,))
-        result = cursor.fetchone()
-        conn.close()
-        return result
+    async def admin_pause_broadcast(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Pause a running broadcast"""
+        await self.control_broadcast(update, context, self.broadcasts.pause, "paused", "running")
 
-    def is_user_premium(self, user_id: int) -> bool:
-        """Check if user has active premium"""
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        cursor.execute('''
-            SELECT is_premium, premium_expires FROM users 
-            WHERE user_id = ?
-        ''', (user_id,))
-        result = cursor.fetchone()
-        conn.close()
+    async def admin_resume_broadcast(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Resume a paused broadcast"""
+        await self.control_broadcast(update, context, self.broadcasts.resume, "resumed", "paused")
+
+    async def admin_cancel_broadcast(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Cancel a running or paused broadcast"""
+        await self.control_broadcast(update, context, self.broadcasts.cancel, "cancelled", "running or paused")
+
+    async def control_broadcast(self, update: Update, context: ContextTypes.DEFAULT_TYPE,
+                                action, done: str, expected: str):
+        """Shared admin check and argument parsing for the broadcast controls"""
+        if update.effective_user.id not in self.ADMIN_IDS:
+            await update.message.reply_text(
+                "❌ You don't have admin access.",
+                reply_markup=ReplyKeyboardRemove()
+            )
+            return
         
-        if not result or not result[0]:
-            return False
+        if not context.args or not context.args[0].lstrip('#').isdigit():
+            await update.message.reply_text(
+                "❌ Usage: /pausebroadcast, /resumebroadcast or /cancelbroadcast <id>\n\n"
+                "Use /broadcasts to see broadcast ids.",
+                reply_markup=ReplyKeyboardRemove()
+            )
+            return
         
-        if result[1]:
-            expires = datetime.fromisoformat(result[1])
-            return datetime.now() < expires
+        job_id = int(context.args[0].lstrip('#'))
+        if await action(job_id):
+            await update.message.reply_text(f"📢 Broadcast #{job_id} {done}.", reply_markup=ReplyKeyboardRemove())
+        else:
+            await update.message.reply_text(
+                f"❌ Broadcast #{job_id} isn't {expected}.",
+                reply_markup=ReplyKeyboardRemove()
+            )
+
+    async def broadcast_recipients(self, after_user_id: int, limit: int) -> List[int]:
+        """Next page of active users for a broadcast, in user_id order"""
+        # Unary + keeps SQLite on the primary key range instead of sorting the is_active index
+        rows = await self.db.afetchall(
+            'SELECT user_id FROM users WHERE user_id > ? AND +is_active = TRUE ORDER BY user_id LIMIT ?',
+            (after_user_id, limit)
+        )
+        return [row[0] for row in rows]
+
+    def get_stats(self) -> tuple:
+        """Get counters for the admin statistics panel"""
+        with self.db.connection() as conn:
+            cursor = conn.cursor()
+            
+            cursor.execute('SELECT COUNT(*) FROM users')
+            total_users = cursor.fetchone()[0]
+            
+            cursor.execute('SELECT COUNT(*) FROM users WHERE is_premium = TRUE')
+            premium_users = cursor.fetchone()[0]
+            
+            cursor.execute('SELECT COUNT(*) FROM chat_sessions WHERE is_active = TRUE')
+            active_chats = cursor.fetchone()[0]
+            
+            cursor.execute('SELECT COUNT(*) FROM messages')
+            total_messages = cursor.fetchone()[0]
+            
+            cursor.execute('SELECT COUNT(*) FROM users WHERE gender = "Male"')
+            male_users = cursor.fetchone()[0]
+            
+            cursor.execute('SELECT COUNT(*) FROM users WHERE gender = "Female"')
+            female_users = cursor.fetchone()[0]
         
-        return False
+        return total_users, premium_users, active_chats, total_messages, male_users, female_users
+
+    def get_user(self, user_id: int) -> Optional[tuple]:
+        """Get user data, from the profile cache when possible"""
+        user = self.profile_cache.get(user_id)
+        if user is MISSING:
+            user = self._read_user(user_id)
+        return user
+
+    async def load_user(self, user_id: int) -> Optional[tuple]:
+        """Async get_user that only leaves the event loop on a cache miss"""
+        user = self.profile_cache.get(user_id)
+        if user is MISSING:
+            user = await self.db.run(self._read_user, user_id)
+        return user
+
+    def _read_user(self, user_id: int) -> Optional[tuple]:
+        """Get user data from database and cache it"""
+        generation = self.profile_cache.generation
+        user = self.db.fetchone('SELECT * FROM users WHERE user_id = ?', (user_id,))
+        self.profile_cache.set(user_id, user, generation)
+        return user
+
+    def is_user_premium(self, user_id: int) -> bool:
+        """Check if user has active premium"""
+        return self.premium_cache.is_premium(user_id)
 
     def get_premium_info(self, user_id: int) -> Optional[tuple]:
         """Get premium information for user"""
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        cursor.execute('''
+        return self.db.fetchone('''
             SELECT is_premium, premium_expires FROM users 
             WHERE user_id = ?
         ''', (user_id,))
-        result = cursor.fetchone()
-        conn.close()
-        return result
-
-    def save_message(self, sender_id: int, receiver_id: int, message_text: str):
-        """Save message to database"""
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        
-        # Get active session
-        cursor.execute('''
-            SELECT session_id FROM chat_sessions 
-            WHERE ((user1_id = ? AND user2_id = ?) OR (user1_id = ? AND user2_id = ?))
-            AND is_active = TRUE
-        ''', (sender_id, receiver_id, receiver_id, sender_id))
-        
-        session = cursor.fetchone()
-        if session:
-            cursor.execute('''
-                INSERT INTO messages (session_id, sender_id, message_text)
-                VALUES (?, ?, ?)
-            ''', (session[0], sender_id, message_text))
-            conn.commit()
-        
-        conn.close()
+
+    def save_messages(self, rows: List[tuple]):
+        """Save a batch of message rows, built in on_relay_delivered, in one transaction"""
+        self.db.executemany('''
+            INSERT INTO messages
+            (session_id, sender_id, message_text, sent_at,
+             media_type, media_file_id, media_file_unique_id, media_file_size)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ''', rows)
 
     def run(self):
         """Start the bot"""
@@ -894,12 +1212,47 @@ class DatingBot:
         print("🔹 NO KEYBOARD PANELS - Commands only!")
         print("\nBot is running...")
         
-        # For deployment platforms like Render, we might need to handle ports
+        # Deployment platforms like Render give web services a PORT to bind
         port = os.getenv('PORT')
         if port:
             print(f"🌐 Running on port {port} (for deployment platform)")
+            asyncio.run(self.serve(int(port), os.getenv('WEBHOOK_URL'), os.getenv('WEBHOOK_SECRET')))
+        else:
+            self.application.run_polling()
+
+    async def serve(self, port: int, webhook_url: Optional[str] = None, secret_token: Optional[str] = None):
+        """Receive updates on the webhook server, falling back to polling if no webhook is set"""
+        server = WebhookServer(self.application, port, secret_token=secret_token)
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, stop.set)
+            except NotImplementedError:
+                pass  # Windows; Ctrl+C still interrupts asyncio.run
         
-        self.application.run_polling()
+        # Same lifecycle as run_polling: initialize, post_init, start ... stop, post_stop, shutdown, post_shutdown
+        await self.application.initialize()
+        try:
+            await self.on_startup(self.application)
+            await server.start()
+            if webhook_url and await server.register(webhook_url):
+                print(f"🔗 Webhook mode: {webhook_url}")
+            else:
+                # start_polling removes any webhook left behind by a previous deploy
+                print("🔁 Polling mode (set WEBHOOK_URL to receive updates by webhook)")
+                await self.application.updater.start_polling()
+            await self.application.start()
+            await stop.wait()
+        finally:
+            if self.application.updater.running:
+                await self.application.updater.stop()
+            if self.application.running:
+                await self.application.stop()
+            await server.stop()
+            await self.on_stop(self.application)
+            await self.application.shutdown()
+            await self.on_shutdown(self.application)
 
 if __name__ == '__main__':
     # Get bot token from environment variable for security
@@ -0,0 +1,376 @@
+"""
+Broadcast engine for Dating Bot
+Sends admin announcements to every active user in the background, through the outbound
+scheduler's broadcast lane, with progress checkpointed in SQLite so jobs survive restarts
+"""
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Set
+
+from telegram import Bot, ReplyKeyboardRemove
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter, TelegramError
+
+from config import (
+    BROADCAST_CONCURRENCY,
+    BROADCAST_MAX_RETRIES,
+    BROADCAST_PAGE_SIZE,
+    BROADCAST_PROGRESS_INTERVAL,
+    BROADCAST_CHECKPOINT_INTERVAL,
+    BROADCAST_STOP_TIMEOUT,
+)
+from database import ConnectionPool
+from outbound import OutboundScheduler, BULK
+
+logger = logging.getLogger(__name__)
+
+# Job states; RUNNING jobs are resumed at startup
+RUNNING = 'running'
+PAUSED = 'paused'
+DONE = 'done'
+CANCELLED = 'cancelled'
+FAILED = 'failed'
+
+
+class BroadcastJob:
+    """Progress of one broadcast
+
+    Recipients are sent in user_id order. last_user_id is a low-water mark: every
+    recipient up to it is finished. Finished recipients above it (sends complete
+    out of order) are kept in a small window, so a checkpoint is one row plus at
+    most a few dozen ids no matter how many users there are.
+    """
+    def __init__(self, job_id: int, text: str, admin_chat_id: int, total: int, status: str = RUNNING,
+                 last_user_id: int = 0, sent: int = 0, failed: int = 0,
+                 progress_message_id: Optional[int] = None, finished_above: Iterable[int] = ()):
+        self.job_id = job_id
+        self.text = text
+        self.admin_chat_id = admin_chat_id
+        self.total = total
+        self.status = status
+        self.last_user_id = last_user_id
+        self.sent = sent
+        self.failed = failed
+        self.retries = 0
+        self.progress_message_id = progress_message_id
+        self.finished_above: Set[int] = set(finished_above)  # Finished before a restart, above the mark
+        self._window: "OrderedDict[int, bool]" = OrderedDict()  # Taken by a sender: user_id -> finished
+        self.stopping: Optional[str] = None  # Status to stop with, once in-flight sends finish
+        self.task: Optional[asyncio.Task] = None
+        self.started_at = time.monotonic()
+        self.finished_at: Optional[float] = None
+        self._done_at_start = sent + failed
+
+    @property
+    def done(self) -> int:
+        return self.sent + self.failed
+
+    @property
+    def rate(self) -> float:
+        """Deliveries per second since this run started"""
+        elapsed = (self.finished_at or time.monotonic()) - self.started_at
+        return (self.done - self._done_at_start) / elapsed if elapsed > 0 else 0.0
+
+    def take(self, user_id: int):
+        self._window[user_id] = False
+
+    def finish(self, user_id: int):
+        """Mark a recipient finished and advance the low-water mark"""
+        self._window[user_id] = True
+        while self._window and next(iter(self._window.values())):
+            self.last_user_id, _ = self._window.popitem(last=False)
+
+    def checkpoint_ids(self) -> List[int]:
+        """Finished recipients above the low-water mark"""
+        above = {user_id for user_id in self.finished_above if user_id > self.last_user_id}
+        above.update(user_id for user_id, finished in self._window.items() if finished)
+        return sorted(above)
+
+
+class BroadcastStore:
+    """broadcast_jobs and broadcast_deliveries tables"""
+    def __init__(self, db: ConnectionPool):
+        self.db = db
+
+    async def create(self, text: str, admin_chat_id: int, total: int) -> int:
+        return await self.db.aexecute(
+            'INSERT INTO broadcast_jobs (message_text, admin_chat_id, total) VALUES (?, ?, ?)',
+            (text, admin_chat_id, total)
+        )
+
+    async def load(self, job_id: int) -> Optional[BroadcastJob]:
+        return await self.db.run(self._load, job_id)
+
+    async def load_running(self) -> List[BroadcastJob]:
+        rows = await self.db.afetchall(
+            'SELECT job_id FROM broadcast_jobs WHERE status = ? ORDER BY job_id', (RUNNING,)
+        )
+        return [job for job in [await self.load(row[0]) for row in rows] if job]
+
+    def _load(self, job_id: int) -> Optional[BroadcastJob]:
+        with self.db.connection() as conn:
+            row = conn.execute('''
+                SELECT job_id, message_text, admin_chat_id, total, status, last_user_id,
+                       sent, failed, progress_message_id
+                FROM broadcast_jobs WHERE job_id = ?
+            ''', (job_id,)).fetchone()
+            if not row:
+                return None
+            above = conn.execute(
+                'SELECT user_id FROM broadcast_deliveries WHERE job_id = ?', (job_id,)
+            ).fetchall()
+        return BroadcastJob(*row, finished_above=[r[0] for r in above])
+
+    async def save(self, job: BroadcastJob, status: Optional[str] = None):
+        """Checkpoint a job in one transaction"""
+        await self.db.run(
+            self._save, job.job_id, status or job.status, job.last_user_id, job.sent, job.failed,
+            job.progress_message_id, job.checkpoint_ids()
+        )
+
+    def _save(self, job_id: int, status: str, last_user_id: int, sent: int, failed: int,
+              progress_message_id: Optional[int], finished_above: List[int]):
+        with self.db.connection() as conn:
+            conn.execute('''
+                UPDATE broadcast_jobs
+                SET status = ?, last_user_id = ?, sent = ?, failed = ?, progress_message_id = ?,
+                    updated_at = CURRENT_TIMESTAMP
+                WHERE job_id = ?
+            ''', (status, last_user_id, sent, failed, progress_message_id, job_id))
+            conn.execute('DELETE FROM broadcast_deliveries WHERE job_id = ?', (job_id,))
+            conn.executemany(
+                'INSERT INTO broadcast_deliveries (job_id, user_id) VALUES (?, ?)',
+                [(job_id, user_id) for user_id in finished_above]
+            )
+
+    async def recent(self, limit: int = 5) -> List[tuple]:
+        """(job_id, status, sent, failed, total) for the latest jobs"""
+        return await self.db.afetchall(
+            'SELECT job_id, status, sent, failed, total FROM broadcast_jobs ORDER BY job_id DESC LIMIT ?',
+            (limit,)
+        )
+
+
+class BroadcastEngine:
+    """Runs broadcasts as background tasks: a producer pages recipients from the
+    database, a bounded pool of senders feeds the outbound scheduler (which owns
+    the rate limits), and monitors checkpoint the job and keep the admin's
+    progress message up to date.
+
+    A recipient sent but not yet checkpointed when the process dies is sent again
+    on resume, so at most BROADCAST_CHECKPOINT_INTERVAL of sends can repeat.
+    """
+    def __init__(self, bot: Bot, outbound: OutboundScheduler, store: BroadcastStore,
+                 recipients: Callable[[int, int], Awaitable[List[int]]],
+                 concurrency: int = BROADCAST_CONCURRENCY, max_retries: int = BROADCAST_MAX_RETRIES,
+                 page_size: int = BROADCAST_PAGE_SIZE, progress_interval: float = BROADCAST_PROGRESS_INTERVAL,
+                 checkpoint_interval: float = BROADCAST_CHECKPOINT_INTERVAL):
+        self.bot = bot
+        self.outbound = outbound
+        self.store = store
+        self.recipients = recipients  # (after_user_id, limit) -> next user ids in ascending order
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.page_size = page_size
+        self.progress_interval = progress_interval
+        self.checkpoint_interval = checkpoint_interval
+        self.jobs: Dict[int, BroadcastJob] = {}  # Jobs started or resumed by this process
+
+    async def start(self, text: str, admin_chat_id: int, total: int) -> BroadcastJob:
+        """Start a broadcast and return at once; progress is reported to admin_chat_id"""
+        job_id = await self.store.create(text, admin_chat_id, total)
+        job = BroadcastJob(job_id, text, admin_chat_id, total)
+        self._launch(job)
+        return job
+
+    async def resume_all(self):
+        """Continue every job that was running when the process last stopped"""
+        for job in await self.store.load_running():
+            logger.info(f"Resuming broadcast {job.job_id} after user {job.last_user_id}")
+            self._launch(job)
+
+    def _launch(self, job: BroadcastJob):
+        job.status = RUNNING
+        self.jobs[job.job_id] = job
+        job.task = asyncio.create_task(self._run(job))
+
+    async def pause(self, job_id: int) -> Optional[BroadcastJob]:
+        """Stop a running job after its in-flight sends; None if it isn't running"""
+        return await self._halt(job_id, PAUSED)
+
+    async def cancel(self, job_id: int) -> Optional[BroadcastJob]:
+        """Stop a running or paused job for good; None if there is nothing to cancel"""
+        job = self.jobs.get(job_id) or await self.store.load(job_id)
+        if job and job.status == PAUSED:
+            job.status = CANCELLED
+            await self.store.save(job)
+            return job
+        return await self._halt(job_id, CANCELLED)
+
+    async def resume(self, job_id: int) -> Optional[BroadcastJob]:
+        """Continue a paused job from its checkpoint; None if it isn't paused"""
+        job = await self.store.load(job_id)
+        if not job or job.status != PAUSED:
+            return None
+        self._launch(job)
+        return job
+
+    async def _halt(self, job_id: int, status: str) -> Optional[BroadcastJob]:
+        job = self.jobs.get(job_id)
+        if not job or job.status != RUNNING or not job.task:
+            return None
+        job.stopping = status
+        await asyncio.shield(job.task)
+        return job
+
+    async def stop(self, timeout: float = BROADCAST_STOP_TIMEOUT):
+        """Checkpoint running jobs for shutdown; they stay RUNNING and resume at startup"""
+        tasks = []
+        for job in self.jobs.values():
+            if job.task and not job.task.done():
+                job.stopping = RUNNING
+                tasks.append(job.task)
+        if not tasks:
+            return
+        _, pending = await asyncio.wait(tasks, timeout=timeout)
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def running(self) -> List[BroadcastJob]:
+        return [job for job in self.jobs.values() if job.status == RUNNING]
+
+    async def _run(self, job: BroadcastJob):
+        recipients: asyncio.Queue = asyncio.Queue(maxsize=self.concurrency * 2)
+        senders = [asyncio.create_task(self._sender(job, recipients)) for _ in range(self.concurrency)]
+        monitors = [asyncio.create_task(self._reporter(job)), asyncio.create_task(self._checkpointer(job))]
+        status = FAILED
+        try:
+            last_id = job.last_user_id
+            while not job.stopping:
+                page = await self.recipients(last_id, self.page_size)
+                if not page:
+                    break
+                for user_id in page:
+                    if job.stopping:
+                        break
+                    if user_id not in job.finished_above:
+                        await recipients.put(user_id)
+                last_id = page[-1]
+            # Senders skip what is left once stopping, so this only waits for in-flight sends
+            await recipients.join()
+            status = job.stopping or DONE
+        except asyncio.CancelledError:
+            status = job.stopping or RUNNING
+            raise
+        except Exception as e:
+            logger.error(f"Broadcast {job.job_id} failed: {e}")
+        finally:
+            job.finished_at = time.monotonic()
+            for task in senders + monitors:
+                task.cancel()
+            await asyncio.gather(*senders, *monitors, return_exceptions=True)
+            job.status = status
+            logger.info(
+                f"Broadcast {job.job_id} {job.status}: {job.sent} sent, {job.failed} failed, "
+                f"{job.retries} retries, {job.rate:.1f} msg/s"
+            )
+            try:
+                await self.store.save(job)
+            except Exception as e:
+                logger.error(f"Broadcast {job.job_id} checkpoint failed: {e}")
+            if job.status != RUNNING:
+                await self._report(job)
+
+    async def _sender(self, job: BroadcastJob, recipients: asyncio.Queue):
+        while True:
+            user_id = await recipients.get()
+            try:
+                if job.stopping:
+                    continue
+                job.take(user_id)
+                try:
+                    delivered = await self._deliver(job, user_id)
+                except Exception as e:
+                    logger.error(f"Broadcast {job.job_id} to {user_id} failed: {e}")
+                    delivered = False
+                if delivered:
+                    job.sent += 1
+                else:
+                    job.failed += 1
+                job.finish(user_id)
+            finally:
+                recipients.task_done()
+
+    async def _deliver(self, job: BroadcastJob, user_id: int) -> bool:
+        """Send to one user, retrying transient errors; False once it can't be delivered"""
+        for attempt in range(self.max_retries + 1):
+            try:
+                await self.outbound.send_message(
+                    BULK, self.bot, user_id,
+                    text=f"📢 Admin Announcement\n\n{job.text}",
+                    reply_markup=ReplyKeyboardRemove()
+                )
+                return True
+            except RetryAfter:
+                pass  # The scheduler has paused every lane for the flood wait
+            except (Forbidden, BadRequest):
+                # Blocked the bot, deleted account, chat not found: retrying won't help
+                return False
+            except NetworkError:
+                await asyncio.sleep(min(2 ** attempt, 30))
+            except TelegramError as e:
+                logger.warning(f"Broadcast {job.job_id} to {user_id} failed: {e}")
+                return False
+            job.retries += 1
+        return False
+
+    async def _checkpointer(self, job: BroadcastJob):
+        while True:
+            await asyncio.sleep(self.checkpoint_interval)
+            try:
+                await self.store.save(job)
+            except Exception as e:
+                logger.error(f"Broadcast {job.job_id} checkpoint failed: {e}")
+
+    async def _reporter(self, job: BroadcastJob):
+        while True:
+            await self._report(job)
+            await asyncio.sleep(self.progress_interval)
+
+    def progress_text(self, job: BroadcastJob) -> str:
+        if job.status == RUNNING:
+            percent = min(job.done / job.total * 100, 100) if job.total else 0
+            return (
+                f"📢 Broadcast #{job.job_id} in progress\n\n"
+                f"📬 {job.done}/{job.total} ({percent:.0f}%)\n"
+                f"✅ Sent: {job.sent}\n"
+                f"❌ Failed: {job.failed}\n"
+                f"⚡ {job.rate:.1f} msg/s\n\n"
+                f"/pausebroadcast {job.job_id} · /cancelbroadcast {job.job_id}"
+            )
+        title = "Complete" if job.status == DONE else job.status.capitalize()
+        text = (
+            f"📢 Broadcast #{job.job_id} {title}\n\n"
+            f"✅ Sent to: {job.sent} users\n"
+            f"❌ Failed: {job.failed} users"
+        )
+        if job.status == PAUSED:
+            text += f"\n\n/resumebroadcast {job.job_id} · /cancelbroadcast {job.job_id}"
+        return text
+
+    async def _report(self, job: BroadcastJob):
+        """Post or update the admin's progress message"""
+        text = self.progress_text(job)
+        try:
+            if job.progress_message_id is None:
+                message = await self.bot.send_message(chat_id=job.admin_chat_id, text=text)
+                job.progress_message_id = message.message_id
+            else:
+                await self.bot.edit_message_text(
+                    text=text, chat_id=job.admin_chat_id, message_id=job.progress_message_id
+                )
+        except TelegramError as e:
+            # "Message is not modified" between identical reports is expected
+            logger.debug(f"Broadcast progress update failed: {e}")
@@ -0,0 +1,123 @@
+"""
+In-process caches for Dating Bot
+Serves hot rows from memory instead of re-querying SQLite
+"""
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Dict, Hashable, Iterable, List, Optional, Tuple
+
+MISSING = object()
+
+
+class LRUCache:
+    """Bounded LRU cache with a per-entry TTL; safe to share with database worker threads"""
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()  # key: (expires_at, value)
+        self._lock = threading.Lock()
+        # Bumped on every invalidation so a read that raced a write can't store stale data
+        self.generation = 0
+
+        # Counters
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable, default: Any = MISSING) -> Any:
+        """Return the cached value, or default when absent or expired"""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[0] <= time.monotonic():
+                if entry is not None:
+                    del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key: Hashable, value: Any, generation: int = None):
+        """Store a value; skipped if an invalidation happened since `generation` was read"""
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key: Hashable):
+        """Drop one key"""
+        with self._lock:
+            self._data.pop(key, None)
+            self.generation += 1
+
+    def clear(self):
+        """Drop everything"""
+        with self._lock:
+            self._data.clear()
+            self.generation += 1
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+
+class PremiumCache:
+    """Premium expiry per user as a precomputed timestamp; users not in it are free"""
+    def __init__(self):
+        self._expires: Dict[int, float] = {}  # user_id: expiry as a Unix timestamp
+        self._lock = threading.Lock()
+
+    def load(self, rows: Iterable[tuple]):
+        """Replace the contents from (user_id, premium_expires) rows"""
+        expires = {}
+        for user_id, premium_expires in rows:
+            if premium_expires:
+                expires[user_id] = parse_timestamp(premium_expires)
+        self._expires = expires
+
+    def grant(self, user_id: int, expires_at: float):
+        with self._lock:
+            self._expires[user_id] = expires_at
+
+    def revoke(self, user_id: int, expires_at: float = None) -> bool:
+        """Drop a user; with expires_at, only if that is still their expiry"""
+        with self._lock:
+            current = self._expires.get(user_id)
+            if current is None or (expires_at is not None and current != expires_at):
+                return False
+            del self._expires[user_id]
+            return True
+
+    def items(self) -> List[Tuple[int, float]]:
+        with self._lock:
+            return list(self._expires.items())
+
+    def expires_at(self, user_id: int) -> Optional[float]:
+        return self._expires.get(user_id)
+
+    def is_premium(self, user_id: int, now: float = None) -> bool:
+        """True until the exact moment premium_expires passes"""
+        expires = self._expires.get(user_id)
+        if expires is None:
+            return False
+        return (time.time() if now is None else now) < expires
+
+    def __len__(self) -> int:
+        return len(self._expires)
+
+
+def parse_timestamp(value) -> float:
+    """Unix timestamp from a stored DATETIME (naive local time, as written by datetime.now())"""
+    if isinstance(value, datetime):
+        return value.timestamp()
+    return datetime.fromisoformat(value).timestamp()
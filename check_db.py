@@ -1,10 +1,11 @@
 import sqlite3
 
+from config import DATABASE_PATH
+from migrations import print_status
+
 try:
-    conn = sqlite3.connect('dating_bot.db')
-    print('Current users table columns:')
-    for i, row in enumerate(conn.execute('PRAGMA table_info(users)').fetchall()):
-        print(f'  {i}: {row[1]} ({row[2]})')
+    conn = sqlite3.connect(DATABASE_PATH)
+    print_status(conn)
     conn.close()
 except Exception as e:
     print(f'Database error: {e}')
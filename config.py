@@ -26,3 +26,83 @@ MAX_BIO_LENGTH = 200
 MIN_AGE = 18
 MAX_AGE = 99
 ANONYMOUS_CHAT = True  # Don't reveal identities during chat
+
+# Database connection pool
+DB_POOL_SIZE = 4  # Long-lived connections shared by the bot
+DB_BUSY_TIMEOUT = 5.0  # Seconds to wait for a locked database
+DB_CACHE_SIZE_KB = 8192  # Page cache per connection
+DB_MMAP_SIZE = 64 * 1024 * 1024  # Bytes of the database file to memory-map
+DB_STATEMENT_CACHE_SIZE = 128  # Prepared statements kept per connection
+
+# Chat message journal (write-behind persistence)
+JOURNAL_BATCH_SIZE = 200  # Flush after this many relayed messages
+JOURNAL_FLUSH_INTERVAL_MS = 250  # ...or after this long, whichever comes first
+JOURNAL_MAX_PENDING = 10000  # Relays wait for a flush once this many are queued
+
+# Online backfills (backfill.py)
+BACKFILL_CHUNK_SIZE = 500  # Rows per short transaction
+BACKFILL_ROWS_PER_SEC = 2000  # Target write rate while the bot is serving
+
+# In-process caches
+PROFILE_CACHE_SIZE = 10000  # Most recently used profiles kept in memory
+PROFILE_CACHE_TTL = 300  # Seconds before a cached profile is re-read
+
+# Premium expiry sweeper
+PREMIUM_SWEEP_MAX_SLEEP = 60  # Seconds between wake-ups when nothing expires sooner
+PREMIUM_EXPIRY_NOTIFY = True  # Tell users when their premium runs out
+
+# Matchmaking
+MATCH_PRIORITY_WEIGHTS = {"premium": 3.0, "free": 1.0}  # Share of contested matches each tier wins
+MATCH_MAX_WAIT = 60  # Seconds after which any waiter is served first (starvation guard)
+MATCH_BATCH_MODE = False  # Pair waiting users in periodic rounds instead of on arrival
+MATCH_BATCH_INTERVAL_MS = 500  # Time between batch matching rounds
+MATCH_CLAIM_ATTEMPTS = 3  # Partners tried when a concurrent search claims them first
+
+# Update processing
+UPDATE_CONCURRENCY = 64  # Handlers running at once across different users
+UPDATE_MAX_IN_FLIGHT = 256  # Updates handed to handlers at once; the rest wait in the ingress queue by priority
+
+# Webhook mode (used when the PORT environment variable is set)
+WEBHOOK_PATH = "/telegram"  # URL path Telegram posts updates to
+WEBHOOK_MAX_BODY = 1024 * 1024  # Largest accepted update, in bytes
+WEBHOOK_MAX_CONNECTIONS = 40  # Parallel connections Telegram may open to us
+WEBHOOK_READ_TIMEOUT = 10  # Seconds to receive a full request
+INGRESS_QUEUE_SIZE = 1000  # Updates received but not yet dispatched; webhook answers 503 beyond this
+INGRESS_SHED_DEPTH = {"matching": 500, "menu": 100}  # Queue depth at which a class is shed; relay never is
+INGRESS_SHED_NOTICE_INTERVAL = 30  # Seconds between "busy" replies to the same chat
+
+# Broadcasts
+BROADCAST_CONCURRENCY = 8  # Sends in flight at once
+BROADCAST_MAX_RETRIES = 3  # Retries per recipient after RetryAfter or network errors
+BROADCAST_PAGE_SIZE = 500  # Recipients read from the database at a time
+BROADCAST_PROGRESS_INTERVAL = 5  # Seconds between progress updates to the admin
+BROADCAST_CHECKPOINT_INTERVAL = 2  # Seconds between progress checkpoints; at most this much is resent after a crash
+BROADCAST_STOP_TIMEOUT = 10  # Seconds shutdown waits for in-flight broadcast sends
+
+# Outbound sends (relay, chat notices and broadcasts share Telegram's limits)
+OUTBOUND_RATE = 25  # Scheduled messages per second across all chats; Telegram allows about 30 including replies
+OUTBOUND_BURST = 10  # Messages that may go out back to back
+OUTBOUND_CHAT_RATE = 1  # Messages per second to one chat once its burst is used
+OUTBOUND_CHAT_BURST = 3  # Messages one chat may receive back to back
+OUTBOUND_LANE_WEIGHTS = {"relay": 8, "lifecycle": 4, "broadcast": 1}  # Share of contested sends per lane
+OUTBOUND_CONCURRENCY = 16  # Sends in flight at once
+OUTBOUND_STOP_TIMEOUT = 5  # Seconds shutdown waits for queued sends
+
+# Telegram HTTP connection pools (interactive: relay, matching, replies; bulk: broadcasts, expiry notices)
+HTTP_INTERACTIVE_POOL_SIZE = 32  # Connections; above OUTBOUND_CONCURRENCY so handler replies never wait behind relay
+HTTP_INTERACTIVE_CONNECT_TIMEOUT = 5  # Seconds to open a connection
+HTTP_INTERACTIVE_READ_TIMEOUT = 5  # Seconds to wait for Telegram's answer
+HTTP_INTERACTIVE_WRITE_TIMEOUT = 5  # Seconds to send a request
+HTTP_INTERACTIVE_POOL_TIMEOUT = 1  # Seconds to wait for a free connection before giving up
+HTTP_BULK_POOL_SIZE = 8  # Connections; at least BROADCAST_CONCURRENCY
+HTTP_BULK_CONNECT_TIMEOUT = 10
+HTTP_BULK_READ_TIMEOUT = 15
+HTTP_BULK_WRITE_TIMEOUT = 15
+HTTP_BULK_POOL_TIMEOUT = 10  # Bulk sends may queue for a connection; nobody is waiting on them
+
+# Relay retries
+RELAY_MAX_ATTEMPTS = 5  # Sends per chat message before it is dead-lettered
+RELAY_RETRY_BASE = 0.5  # Seconds before the first retry; doubles each time, with jitter
+RELAY_RETRY_MAX = 30  # Longest wait between retries, unless Telegram asks for more
+RELAY_STOP_TIMEOUT = 5  # Seconds shutdown waits for retrying messages
+RELAY_COALESCE_MS = 0  # Merge a sender's messages arriving within this window into one (e.g. 300); 0 sends each alone
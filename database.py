@@ -0,0 +1,131 @@
+"""
+SQLite connection pool for Dating Bot
+Keeps a few long-lived WAL connections open instead of reconnecting per query
+and runs blocking database work on dedicated worker threads for async handlers
+"""
+import asyncio
+import functools
+import logging
+import queue
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Any, Callable, Iterable, List, Optional
+
+from config import (
+    DATABASE_PATH,
+    DB_POOL_SIZE,
+    DB_BUSY_TIMEOUT,
+    DB_CACHE_SIZE_KB,
+    DB_MMAP_SIZE,
+    DB_STATEMENT_CACHE_SIZE,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class ConnectionPool:
+    def __init__(self, db_path: str = DATABASE_PATH, size: int = DB_POOL_SIZE,
+                 busy_timeout: float = DB_BUSY_TIMEOUT, cache_size_kb: int = DB_CACHE_SIZE_KB,
+                 mmap_size: int = DB_MMAP_SIZE, statement_cache_size: int = DB_STATEMENT_CACHE_SIZE):
+        self.db_path = db_path
+        self.size = size
+        self.busy_timeout = busy_timeout
+        self.cache_size_kb = cache_size_kb
+        self.mmap_size = mmap_size
+        self.statement_cache_size = statement_cache_size
+        self._idle: "queue.LifoQueue[sqlite3.Connection]" = queue.LifoQueue(maxsize=size)
+        self._all: List[sqlite3.Connection] = []
+        self._closed = False
+        # One worker per connection so queued work never waits on the pool itself
+        self._executor = ThreadPoolExecutor(max_workers=size, thread_name_prefix="db-worker")
+
+        for _ in range(size):
+            conn = self._connect()
+            self._all.append(conn)
+            self._idle.put(conn)
+
+    def _connect(self) -> sqlite3.Connection:
+        """Open one tuned connection"""
+        conn = sqlite3.connect(
+            self.db_path,
+            timeout=self.busy_timeout,
+            check_same_thread=False,
+            cached_statements=self.statement_cache_size,
+        )
+        conn.execute('PRAGMA journal_mode = WAL')
+        conn.execute('PRAGMA synchronous = NORMAL')
+        conn.execute(f'PRAGMA cache_size = -{int(self.cache_size_kb)}')
+        conn.execute(f'PRAGMA mmap_size = {int(self.mmap_size)}')
+        conn.execute('PRAGMA temp_store = MEMORY')
+        return conn
+
+    @contextmanager
+    def connection(self):
+        """Borrow a connection; commits on success and rolls back on error"""
+        if self._closed:
+            raise RuntimeError("Connection pool is closed")
+
+        conn = self._idle.get(timeout=self.busy_timeout)
+        try:
+            yield conn
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            self._idle.put(conn)
+
+    def fetchone(self, sql: str, params: Iterable = ()) -> Optional[tuple]:
+        """Run a query and return the first row"""
+        with self.connection() as conn:
+            return conn.execute(sql, tuple(params)).fetchone()
+
+    def fetchall(self, sql: str, params: Iterable = ()) -> List[tuple]:
+        """Run a query and return every row"""
+        with self.connection() as conn:
+            return conn.execute(sql, tuple(params)).fetchall()
+
+    def execute(self, sql: str, params: Iterable = ()) -> int:
+        """Run a write statement and return the last inserted row id"""
+        with self.connection() as conn:
+            return conn.execute(sql, tuple(params)).lastrowid
+
+    def executemany(self, sql: str, rows: Iterable[Iterable]) -> int:
+        """Run a write statement for many rows in one transaction"""
+        with self.connection() as conn:
+            return conn.executemany(sql, rows).rowcount
+
+    async def run(self, func: Callable[..., Any], *args, **kwargs) -> Any:
+        """Run a blocking database call on a worker thread and await its result"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, functools.partial(func, *args, **kwargs))
+
+    async def afetchone(self, sql: str, params: Iterable = ()) -> Optional[tuple]:
+        """Async version of fetchone"""
+        return await self.run(self.fetchone, sql, params)
+
+    async def afetchall(self, sql: str, params: Iterable = ()) -> List[tuple]:
+        """Async version of fetchall"""
+        return await self.run(self.fetchall, sql, params)
+
+    async def aexecute(self, sql: str, params: Iterable = ()) -> int:
+        """Async version of execute"""
+        return await self.run(self.execute, sql, params)
+
+    async def aexecutemany(self, sql: str, rows: Iterable[Iterable]) -> int:
+        """Async version of executemany"""
+        return await self.run(self.executemany, sql, list(rows))
+
+    def close(self):
+        """Finish queued work and close every pooled connection"""
+        if self._closed:
+            return
+        self._executor.shutdown(wait=True)
+        self._closed = True
+        for conn in self._all:
+            try:
+                conn.close()
+            except sqlite3.Error as e:
+                logger.warning(f"Error closing database connection: {e}")
+        self._all.clear()
@@ -0,0 +1,79 @@
+"""
+HTTP connection pools for Dating Bot
+Interactive and bulk Telegram traffic get separate pools so a broadcast can't starve chat replies
+"""
+import logging
+from typing import Tuple
+
+import httpx
+from telegram.error import TimedOut
+from telegram.request import HTTPXRequest
+
+logger = logging.getLogger(__name__)
+
+INTERACTIVE = 'interactive'  # Relay, matching and replies to commands
+BULK = 'bulk'  # Broadcasts and sweeper notifications
+
+
+class PooledRequest(HTTPXRequest):
+    """HTTPXRequest that counts requests, new connections and pool timeouts
+
+    New connections are seen through httpcore's trace extension, so every request
+    that doesn't open one reused a kept-alive connection. A pool timeout means all
+    pool_size connections stayed busy for pool_timeout seconds and the request was
+    never sent.
+    """
+    def __init__(self, name: str, pool_size: int, connect_timeout: float, read_timeout: float,
+                 write_timeout: float, pool_timeout: float):
+        self.name = name
+        self.pool_size = pool_size
+
+        # Counters
+        self.requests = 0
+        self.connections_opened = 0
+        self.pool_timeouts = 0
+        self.errors = 0  # Timeouts and network errors, pool timeouts included
+        self.in_flight = 0
+        self.peak_in_flight = 0
+
+        super().__init__(
+            connection_pool_size=pool_size,
+            connect_timeout=connect_timeout,
+            read_timeout=read_timeout,
+            write_timeout=write_timeout,
+            pool_timeout=pool_timeout,
+            httpx_kwargs={'event_hooks': {'request': [self._on_request]}},
+        )
+
+    async def _on_request(self, request: httpx.Request):
+        request.extensions['trace'] = self._trace
+
+    async def _trace(self, event_name: str, info: dict):
+        if event_name == 'connection.connect_tcp.complete':
+            self.connections_opened += 1
+
+    async def do_request(self, *args, **kwargs) -> Tuple[int, bytes]:
+        self.requests += 1
+        self.in_flight += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        try:
+            return await super().do_request(*args, **kwargs)
+        except TimedOut as e:
+            self.errors += 1
+            if e.message.startswith('Pool timeout'):
+                self.pool_timeouts += 1
+                logger.warning(f"HTTP pool '{self.name}' exhausted ({self.pool_size} connections)")
+            raise
+        except Exception:
+            self.errors += 1
+            raise
+        finally:
+            self.in_flight -= 1
+
+    @property
+    def reuse_rate(self) -> float:
+        """Share of requests that went out on an already open connection"""
+        if not self.requests:
+            return 0.0
+        return max(0.0, 1 - self.connections_opened / self.requests)
+
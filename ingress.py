@@ -0,0 +1,188 @@
+"""
+Ingress queue for Dating Bot
+Bounded, prioritized intake between Telegram and the handlers, with load shedding
+"""
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Callable, Deque, Dict, List, Optional
+
+from config import INGRESS_QUEUE_SIZE, INGRESS_SHED_DEPTH, UPDATE_MAX_IN_FLIGHT
+
+logger = logging.getLogger(__name__)
+
+# Update classes, highest priority first
+RELAY = 0  # Chat messages between partners
+MATCHING = 1  # Searching, stopping chats, profile answers
+MENU = 2  # Menus, /help and everything else
+CLASS_NAMES = ('relay', 'matching', 'menu')
+
+
+def _user_of(update: object) -> Optional[int]:
+    user = getattr(update, 'effective_user', None)
+    return user.id if user else None
+
+
+class _Lanes:
+    """One FIFO per lane; always serves the highest-priority non-empty one"""
+    def __init__(self):
+        self.lanes: List[Deque] = [deque() for _ in CLASS_NAMES]
+
+    def append(self, entry: tuple):
+        self.lanes[entry[0]].append(entry)
+
+    def popleft(self) -> tuple:
+        for lane in self.lanes:
+            if lane:
+                return lane.popleft()
+        raise IndexError('pop from empty lanes')
+
+    def __len__(self) -> int:
+        return sum(len(lane) for lane in self.lanes)
+
+
+class IngressQueue(asyncio.Queue):
+    """Application update queue that hands out relay first, then matching, then menus
+
+    Priorities apply across users only: an update never goes ahead of one queued
+    earlier by the same user, so it waits in that update's lane when its own
+    class ranks higher. At most max_in_flight updates are handed out before their task_done(), so a
+    backlog stays here where priorities apply. Past INGRESS_SHED_DEPTH queued
+    updates a class is shed (answered by on_shed instead of run); past maxsize
+    everything else waits (polling) or is refused with QueueFull (webhook, 503).
+    classify returns None for control objects such as the application's stop
+    signal: they queue last and are never shed.
+    """
+    def __init__(self, classify: Callable[[object], Optional[int]],
+                 on_shed: Optional[Callable[[object], None]] = None,
+                 maxsize: int = INGRESS_QUEUE_SIZE, max_in_flight: int = UPDATE_MAX_IN_FLIGHT,
+                 shed_depth: Dict[str, int] = INGRESS_SHED_DEPTH):
+        super().__init__(maxsize)
+        self.classify = classify
+        self.on_shed = on_shed
+        self.max_in_flight = max_in_flight
+        self.shed_depth = [shed_depth.get(name) for name in CLASS_NAMES]  # None: never shed
+        self._slots = asyncio.Semaphore(max_in_flight)
+        self._in_flight = 0
+        self._putting = MENU  # Class of the update being put, read by _put
+        self._users: Dict[int, List[int]] = {}  # user_id: [queued updates, lane of the newest]
+
+        # Counters
+        self.shed = [0] * len(CLASS_NAMES)
+        self.served = [0] * len(CLASS_NAMES)
+        self.max_depth = 0
+
+    def _init(self, maxsize: int):
+        self._queue = _Lanes()
+
+    def _put(self, update: object):
+        priority = lane = self._putting
+        user_id = _user_of(update)
+        if user_id is not None:
+            queued = self._users.get(user_id)
+            if queued:
+                # Lanes are served in order, so no higher than the user's last queued update
+                lane = max(lane, queued[1])
+                queued[0] += 1
+                queued[1] = lane
+            else:
+                self._users[user_id] = [1, lane]
+        self._queue.append((lane, priority, user_id, update))
+        self.max_depth = max(self.max_depth, len(self._queue))
+
+    def _get(self) -> object:
+        _, priority, user_id, update = self._queue.popleft()
+        if user_id is not None:
+            queued = self._users[user_id]
+            queued[0] -= 1
+            if not queued[0]:
+                del self._users[user_id]
+        self.served[priority] += 1
+        return update
+
+    def _class_of(self, update: object) -> Optional[int]:
+        try:
+            return self.classify(update)
+        except Exception as e:
+            logger.error(f"Update classification failed: {e}")
+            return MENU
+
+    def _should_shed(self, priority: Optional[int]) -> bool:
+        if priority is None:
+            return False
+        depth = self.shed_depth[priority]
+        if depth is None or self.qsize() < depth:
+            return False
+        self.shed[priority] += 1
+        return True
+
+    def put_nowait(self, update: object):
+        priority = self._class_of(update)
+        if self._should_shed(priority):
+            self._shed(update)
+            return
+        self._putting = MENU if priority is None else priority
+        super().put_nowait(update)
+
+    async def put(self, update: object):
+        # Shed before waiting for room; the base put ends in put_nowait
+        if self._should_shed(self._class_of(update)):
+            self._shed(update)
+            return
+        await super().put(update)
+
+    def _shed(self, update: object):
+        if self.on_shed:
+            try:
+                self.on_shed(update)
+            except Exception as e:
+                logger.error(f"Shed handler failed: {e}")
+
+    async def get(self) -> object:
+        """Wait for a free in-flight slot, then take the highest-priority update"""
+        await self._slots.acquire()
+        try:
+            update = await super().get()
+        except BaseException:
+            self._slots.release()
+            raise
+        self._in_flight += 1
+        return update
+
+    def task_done(self):
+        super().task_done()
+        if self._in_flight:
+            self._in_flight -= 1
+            self._slots.release()
+
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight
+
+    def depths(self) -> Dict[str, int]:
+        """Queued updates per lane"""
+        return {name: len(lane) for name, lane in zip(CLASS_NAMES, self._queue.lanes)}
+
+    def shed_counts(self) -> Dict[str, int]:
+        return dict(zip(CLASS_NAMES, self.shed))
+
+
+class ShedNotifier:
+    """Canned "busy" reply for shed updates, at most once per chat per interval"""
+    def __init__(self, send: Callable[[int], object], interval: float):
+        self.send = send  # Coroutine function taking a chat id
+        self.interval = interval
+        self._last: Dict[int, float] = {}
+
+    def __call__(self, update: object):
+        chat = getattr(update, 'effective_chat', None)
+        if chat is None:
+            return
+        now = time.monotonic()
+        if now - self._last.get(chat.id, float('-inf')) < self.interval:
+            return
+        if len(self._last) > 10000:
+            self._last = {k: v for k, v in self._last.items() if now - v < self.interval}
+        self._last[chat.id] = now
+        asyncio.get_running_loop().create_task(self.send(chat.id))
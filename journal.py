@@ -0,0 +1,111 @@
+"""
+Write-behind message journal for Dating Bot
+Queues relayed chat messages in memory and persists them in batched transactions
+"""
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, List, Optional
+
+from config import JOURNAL_BATCH_SIZE, JOURNAL_FLUSH_INTERVAL_MS, JOURNAL_MAX_PENDING
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+class MessageJournal:
+    def __init__(self, writer: Callable[[List[Any]], Awaitable[Any]],
+                 batch_size: int = JOURNAL_BATCH_SIZE,
+                 flush_interval_ms: int = JOURNAL_FLUSH_INTERVAL_MS,
+                 max_pending: int = JOURNAL_MAX_PENDING):
+        self.writer = writer  # Persists one batch of rows in a single transaction
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval_ms / 1000
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=max_pending)
+        self._batch_ready = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._stopped = False
+
+        # Counters
+        self.written = 0
+        self.flushes = 0
+        self.failed = 0
+
+    @property
+    def pending(self) -> int:
+        return self._queue.qsize()
+
+    def start(self):
+        """Start the background flush loop"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._flush_loop())
+
+    async def append(self, row: Any):
+        """Queue a row; waits while the journal is full"""
+        if self._stopped:
+            raise RuntimeError("Message journal is stopped")
+
+        await self._queue.put(row)
+        if self._queue.qsize() >= self.batch_size:
+            self._batch_ready.set()
+
+    async def stop(self):
+        """Flush everything still queued and stop the flush loop"""
+        if self._stopped:
+            return
+        self._stopped = True
+
+        if self._task is not None:
+            await self._queue.put(_STOP)
+            self._batch_ready.set()
+            await self._task
+
+        # Rows from appends that were already waiting for space
+        batch = self._drain(self.batch_size)
+        while batch:
+            await self._write(batch)
+            batch = self._drain(self.batch_size)
+
+    async def _flush_loop(self):
+        """Write a batch every batch_size rows or flush_interval seconds"""
+        while True:
+            first = await self._queue.get()
+            batch = [first] if first is not _STOP else []
+            done = first is _STOP
+
+            if not done and self._queue.qsize() < self.batch_size - 1:
+                self._batch_ready.clear()
+                try:
+                    await asyncio.wait_for(self._batch_ready.wait(), self.flush_interval)
+                except asyncio.TimeoutError:
+                    pass
+
+            while not done and len(batch) < self.batch_size and not self._queue.empty():
+                row = self._queue.get_nowait()
+                if row is _STOP:
+                    done = True
+                else:
+                    batch.append(row)
+
+            if batch:
+                await self._write(batch)
+            if done:
+                # _STOP is always the last item queued
+                return
+
+    def _drain(self, limit: int) -> List[Any]:
+        batch = []
+        while len(batch) < limit and not self._queue.empty():
+            row = self._queue.get_nowait()
+            if row is not _STOP:
+                batch.append(row)
+        return batch
+
+    async def _write(self, batch: List[Any]):
+        try:
+            await self.writer(batch)
+            self.written += len(batch)
+            self.flushes += 1
+        except Exception as e:
+            self.failed += len(batch)
+            logger.error(f"Failed to persist {len(batch)} journaled messages: {e}")
@@ -0,0 +1,408 @@
+"""
+In-memory matchmaking for Dating Bot
+Keeps available users in segments so a partner is picked in O(1) instead of ORDER BY RANDOM(),
+queues users who are waiting so they are paired as soon as someone compatible searches,
+and can instead pair the whole waiting pool at once in batch rounds
+"""
+import random
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Deque, Dict, Iterable, List, Optional, Set, Tuple
+
+from config import MATCH_PRIORITY_WEIGHTS, MATCH_MAX_WAIT
+
+# Segments follow the matching rules: free males only meet males, premium users meet anyone
+MALE = 'male'
+OTHER = 'other'
+SEGMENTS = (MALE, OTHER)
+
+# Tiers for priority matching
+PREMIUM = 'premium'
+FREE = 'free'
+
+
+def segment_for(gender: Optional[str]) -> str:
+    return MALE if gender == 'Male' else OTHER
+
+
+def eligible_segments(gender: Optional[str], is_premium: bool) -> Tuple[str, ...]:
+    """Segments a searcher may be matched from"""
+    if is_premium:
+        # Premium users can match with anyone
+        return SEGMENTS
+    if gender == 'Male':
+        # Non-premium males can only match with other males
+        return (MALE,)
+    # Non-premium females cannot start chats (need premium)
+    return ()
+
+
+class RandomSet:
+    """Set with O(1) add, remove and uniform random choice"""
+    def __init__(self):
+        self._items: List[int] = []
+        self._index: Dict[int, int] = {}
+
+    def add(self, item: int):
+        if item not in self._index:
+            self._index[item] = len(self._items)
+            self._items.append(item)
+
+    def discard(self, item: int):
+        index = self._index.pop(item, None)
+        if index is None:
+            return
+        last = self._items.pop()
+        if index < len(self._items):
+            # Move the last item into the hole
+            self._items[index] = last
+            self._index[last] = index
+
+    def clear(self):
+        self._items.clear()
+        self._index.clear()
+
+    def __contains__(self, item: int) -> bool:
+        return item in self._index
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def __iter__(self):
+        return iter(self._items)
+
+    def item_at(self, position: int) -> int:
+        return self._items[position]
+
+
+class MatchPool:
+    """Users who could be pulled into a chat right now, split by segment
+
+    The database stays the source of truth; the pool is rebuilt from it at startup
+    and kept in step by profile writes and chat start/end. claim_pair is the only
+    way into a chat, so two searches can never take the same partner.
+    """
+    def __init__(self):
+        self._segments: Dict[str, RandomSet] = {name: RandomSet() for name in SEGMENTS}
+        self._genders: Dict[int, Optional[str]] = {}  # Every active user, available or not
+        self._busy: Set[int] = set()  # Users claimed for or in a chat
+        self._lock = threading.RLock()
+
+    def load(self, users: Iterable[Tuple[int, Optional[str]]], busy: Iterable[int] = ()):
+        """Rebuild from (user_id, gender) rows and the ids already in chats"""
+        with self._lock:
+            for pool in self._segments.values():
+                pool.clear()
+            self._genders.clear()
+            self._busy = set(busy)
+            for user_id, gender in users:
+                self.register(user_id, gender)
+
+    def register(self, user_id: int, gender: Optional[str]):
+        """Add or update an active user; users in a chat stay out of the pool"""
+        with self._lock:
+            self.unregister(user_id)
+            self._genders[user_id] = gender
+            if user_id not in self._busy:
+                self._segments[segment_for(gender)].add(user_id)
+
+    def unregister(self, user_id: int):
+        """Forget a user entirely (deleted or deactivated)"""
+        with self._lock:
+            gender = self._genders.pop(user_id, None)
+            self._segments[segment_for(gender)].discard(user_id)
+
+    def claim_pair(self, user1_id: int, user2_id: int) -> bool:
+        """Atomically take both users out of the pool; False if either is already claimed"""
+        with self._lock:
+            if user1_id == user2_id or user1_id in self._busy or user2_id in self._busy:
+                return False
+            self.reserve(user1_id)
+            self.reserve(user2_id)
+            return True
+
+    def reserve(self, user_id: int):
+        """Take a user out of the pool while they chat"""
+        with self._lock:
+            self._busy.add(user_id)
+            if user_id in self._genders:
+                self._segments[segment_for(self._genders[user_id])].discard(user_id)
+
+    def release(self, user_id: int):
+        """Put a user back once their chat ends"""
+        with self._lock:
+            self._busy.discard(user_id)
+            if user_id in self._genders:
+                self._segments[segment_for(self._genders[user_id])].add(user_id)
+
+    def is_available(self, user_id: int) -> bool:
+        return user_id in self._genders and user_id not in self._busy
+
+    def is_busy(self, user_id: int) -> bool:
+        return user_id in self._busy
+
+    def gender_of(self, user_id: int) -> Optional[str]:
+        return self._genders.get(user_id)
+
+    def pick(self, user_id: int, segments: Tuple[str, ...]) -> Optional[int]:
+        """Uniform random available user from the given segments, never user_id itself"""
+        with self._lock:
+            return self._pick(user_id, segments)
+
+    def _pick(self, user_id: int, segments: Tuple[str, ...]) -> Optional[int]:
+        pools = [self._segments[name] for name in segments]
+        sizes = [len(pool) - (user_id in pool) for pool in pools]
+        total = sum(sizes)
+        if total <= 0:
+            return None
+
+        position = random.randrange(total)
+        for pool, size in zip(pools, sizes):
+            if position < size:
+                candidate = pool.item_at(position)
+                if candidate == user_id:
+                    # Skip over the searcher: its slot is taken by the pool's last item
+                    candidate = pool.item_at(len(pool) - 1)
+                return candidate
+            position -= size
+        return None
+
+    def size(self, segment: str = None) -> int:
+        if segment:
+            return len(self._segments[segment])
+        return sum(len(pool) for pool in self._segments.values())
+
+
+def _lane_segments(segment: str, is_premium: bool) -> Tuple[str, ...]:
+    """Segments a waiter in this lane may be matched from"""
+    return eligible_segments('Male' if segment == MALE else None, is_premium)
+
+
+def _tier(lane: Tuple[str, bool]) -> str:
+    return PREMIUM if lane[1] else FREE
+
+
+class WaitStats:
+    """Wait-time counters for one tier of matched waiters"""
+    def __init__(self, window: int = 1000):
+        self.matched = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self._recent: Deque[float] = deque(maxlen=window)
+
+    def record(self, waited: float):
+        self.matched += 1
+        self.total_wait += waited
+        self.max_wait = max(self.max_wait, waited)
+        self._recent.append(waited)
+
+    @property
+    def average(self) -> float:
+        return self.total_wait / self.matched if self.matched else 0.0
+
+    def percentile(self, pct: float) -> float:
+        """Wait at the given percentile over the most recent matches"""
+        if not self._recent:
+            return 0.0
+        ordered = sorted(self._recent)
+        return ordered[min(int(len(ordered) * pct / 100), len(ordered) - 1)]
+
+
+class WaitingQueue:
+    """Users waiting for a partner, FIFO within each lane
+
+    A lane is (segment, is_premium), so every waiter in a lane follows the same
+    matching rule and only lane heads compete for an arriving user. When both tiers
+    compete, premium and free take turns in proportion to their weights (3:1 by
+    default); anyone waiting longer than max_wait jumps ahead so free users can't starve.
+    """
+    def __init__(self, weights: Dict[str, float] = None, max_wait: float = MATCH_MAX_WAIT):
+        self.weights = weights or MATCH_PRIORITY_WEIGHTS
+        self.max_wait = max_wait
+        self._lanes: Dict[Tuple[str, bool], "OrderedDict[int, float]"] = {
+            (segment, is_premium): OrderedDict() for segment in SEGMENTS for is_premium in (False, True)
+        }  # lane: {user_id: time queued}
+        self._lane_of: Dict[int, Tuple[str, bool]] = {}
+        self.stats: Dict[str, WaitStats] = {PREMIUM: WaitStats(), FREE: WaitStats()}
+        self._credits: Dict[str, float] = {PREMIUM: 0.0, FREE: 0.0}
+
+    def enqueue(self, user_id: int, gender: Optional[str], is_premium: bool):
+        """Add a user to the back of their lane"""
+        self.cancel(user_id)
+        lane = (segment_for(gender), bool(is_premium))
+        self._lanes[lane][user_id] = time.monotonic()
+        self._lane_of[user_id] = lane
+
+    def cancel(self, user_id: int, matched: bool = False) -> bool:
+        """Remove a waiting user; False if they weren't waiting
+
+        Pass matched=True when they leave because they were paired some other way,
+        so their wait still counts in the tier metrics.
+        """
+        lane = self._lane_of.pop(user_id, None)
+        if lane is None:
+            return False
+        queued_at = self._lanes[lane].pop(user_id)
+        if matched:
+            self.stats[_tier(lane)].record(time.monotonic() - queued_at)
+        return True
+
+    def next_partner(self, user_id: int, gender: Optional[str], is_premium: bool) -> Optional[int]:
+        """The highest-priority waiter who can be matched with an arriving user
+
+        They stay queued; cancel(matched=True) removes them once their chat has
+        started, so a failed start doesn't lose their place.
+        """
+        segment = segment_for(gender)
+        eligible = eligible_segments(gender, is_premium)
+        now = time.monotonic()
+
+        # Longest-waiting compatible lane head in each tier
+        heads: Dict[str, Tuple[float, Tuple[str, bool]]] = {}
+        for lane, waiters in self._lanes.items():
+            if not waiters:
+                continue
+            # Either side's rule may allow the match: the arrival picks them or they pick the arrival
+            lane_segment, lane_premium = lane
+            if lane_segment not in eligible and segment not in _lane_segments(lane_segment, lane_premium):
+                continue
+            waiter, queued_at = next(iter(waiters.items()))
+            if waiter == user_id:
+                continue
+            tier = _tier(lane)
+            if tier not in heads or queued_at < heads[tier][0]:
+                heads[tier] = (queued_at, lane)
+
+        if not heads:
+            return None
+
+        starving = [head for head in heads.values() if now - head[0] >= self.max_wait]
+        if starving:
+            # Starvation guard: anyone past max_wait goes first, oldest first
+            _, lane = min(starving)
+        elif len(heads) == 1:
+            _, lane = next(iter(heads.values()))
+        else:
+            _, lane = heads[self._next_tier(heads)]
+
+        return next(iter(self._lanes[lane]))
+
+    def _next_tier(self, competing) -> str:
+        """Smooth weighted round robin between the tiers competing for one match"""
+        total = 0.0
+        for tier in competing:
+            weight = self.weights.get(tier, 1.0)
+            self._credits[tier] += weight
+            total += weight
+        winner = max(competing, key=lambda tier: self._credits[tier])
+        self._credits[winner] -= total
+        return winner
+
+    def snapshot(self) -> List[Tuple[int, Tuple[str, bool], float]]:
+        """Every waiter as (user_id, lane, time queued)"""
+        return [
+            (user_id, lane, queued_at)
+            for lane, waiters in self._lanes.items()
+            for user_id, queued_at in waiters.items()
+        ]
+
+    def overdue(self, max_wait: float = None) -> List[int]:
+        """Waiters who have waited at least max_wait seconds"""
+        cutoff = time.monotonic() - (self.max_wait if max_wait is None else max_wait)
+        return [user_id for user_id, _, queued_at in self.snapshot() if queued_at <= cutoff]
+
+    def waiting(self, tier: str = None) -> int:
+        """Number of users waiting, optionally in one tier"""
+        if tier is None:
+            return len(self._lane_of)
+        return sum(len(waiters) for lane, waiters in self._lanes.items() if _tier(lane) == tier)
+
+    def __contains__(self, user_id: int) -> bool:
+        return user_id in self._lane_of
+
+    def __len__(self) -> int:
+        return len(self._lane_of)
+
+
+# Bonus that makes overdue waiters outrank any compatibility difference
+OVERDUE_BONUS = 100.0
+
+
+def lanes_compatible(lane_a: Tuple[str, bool], lane_b: Tuple[str, bool]) -> bool:
+    """True if either waiter's rule allows matching with the other"""
+    return lane_b[0] in _lane_segments(*lane_a) or lane_a[0] in _lane_segments(*lane_b)
+
+
+def _answer(profile: Optional[tuple], column: int) -> Optional[str]:
+    value = profile[column] if profile else None
+    if not value or str(value).strip().lower() in ('skip', 'not specified'):
+        return None
+    return str(value).strip().lower()
+
+
+def compatibility(profile_a: Optional[tuple], profile_b: Optional[tuple]) -> float:
+    """Score a pair from their (favorite_game, favorite_movie, favorite_music, age_years) rows
+
+    Shared favorites and close ages score higher.
+    """
+    score = 1.0  # Any allowed pair beats leaving both users waiting
+    # favorite_game, favorite_movie, favorite_music
+    for column in (0, 1, 2):
+        answer = _answer(profile_a, column)
+        if answer and answer == _answer(profile_b, column):
+            score += 1.0
+    # age_years
+    age_a = profile_a[3] if profile_a else None
+    age_b = profile_b[3] if profile_b else None
+    if age_a is not None and age_b is not None:
+        score += max(0.0, 1.0 - abs(age_a - age_b) / 10)
+    return score
+
+
+def plan_pairs(waiters: List[Tuple[int, Tuple[str, bool], float]], profiles: Dict[int, tuple],
+               now: float, max_wait: float = MATCH_MAX_WAIT, improve_passes: int = 3) -> List[Tuple[int, int]]:
+    """Pair up waiters, maximizing total compatibility under the matching rules
+
+    waiters are (user_id, lane, queued_at). Pairs are chosen greedily by score,
+    with waiters past max_wait first, then improved by swapping partners between
+    pairs while that raises the total.
+    """
+    weights: Dict[Tuple[int, int], float] = {}
+    edges = []
+    for i, (user_a, lane_a, queued_a) in enumerate(waiters):
+        overdue_a = now - queued_a >= max_wait
+        for user_b, lane_b, queued_b in waiters[i + 1:]:
+            if not lanes_compatible(lane_a, lane_b):
+                continue
+            overdue = overdue_a + (now - queued_b >= max_wait)
+            weight = compatibility(profiles.get(user_a), profiles.get(user_b)) + overdue * OVERDUE_BONUS
+            weights[(user_a, user_b)] = weights[(user_b, user_a)] = weight
+            edges.append((weight, user_a, user_b))
+
+    edges.sort(key=lambda edge: edge[0], reverse=True)
+    paired: Set[int] = set()
+    pairs: List[Tuple[int, int]] = []
+    for _, user_a, user_b in edges:
+        if user_a not in paired and user_b not in paired:
+            pairs.append((user_a, user_b))
+            paired.update((user_a, user_b))
+
+    # 2-opt: re-pair (a, b), (c, d) as (a, c), (b, d) or (a, d), (b, c) when that scores higher
+    for _ in range(improve_passes):
+        improved = False
+        for i in range(len(pairs)):
+            for j in range(i + 1, len(pairs)):
+                (a, b), (c, d) = pairs[i], pairs[j]
+                current = weights[(a, b)] + weights[(c, d)]
+                for first, second in (((a, c), (b, d)), ((a, d), (b, c))):
+                    if first in weights and second in weights and weights[first] + weights[second] > current:
+                        pairs[i], pairs[j] = first, second
+                        current = weights[first] + weights[second]
+                        a, b = first
+                        c, d = second
+                        improved = True
+        if not improved:
+            break
+
+    return pairs
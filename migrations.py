@@ -0,0 +1,266 @@
+"""
+Versioned schema migrations for Dating Bot
+Each step runs once, in order, and is recorded in the schema_version table
+
+Usage:
+    python migrations.py           # apply pending migrations
+    python migrations.py status    # show current version and pending steps
+"""
+import logging
+import sqlite3
+import sys
+from typing import Callable, List, Tuple
+
+from config import DATABASE_PATH
+from schema import ensure_indexes
+
+logger = logging.getLogger(__name__)
+
+
+def _create_tables(cursor: sqlite3.Cursor):
+    # Users table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS users (
+            user_id INTEGER PRIMARY KEY,
+            username TEXT,
+            first_name TEXT,
+            gender TEXT,
+            age TEXT,
+            favorite_game TEXT,
+            favorite_movie TEXT,
+            favorite_music TEXT,
+            interests TEXT,
+            photo_url TEXT,
+            is_premium BOOLEAN DEFAULT FALSE,
+            premium_expires DATETIME,
+            is_active BOOLEAN DEFAULT TRUE,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            last_active DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+    # Chat sessions table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS chat_sessions (
+            session_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user1_id INTEGER,
+            user2_id INTEGER,
+            started_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            ended_at DATETIME,
+            is_active BOOLEAN DEFAULT TRUE,
+            FOREIGN KEY (user1_id) REFERENCES users (user_id),
+            FOREIGN KEY (user2_id) REFERENCES users (user_id)
+        )
+    ''')
+
+    # Messages table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS messages (
+            message_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            session_id INTEGER,
+            sender_id INTEGER,
+            message_text TEXT,
+            sent_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (session_id) REFERENCES chat_sessions (session_id),
+            FOREIGN KEY (sender_id) REFERENCES users (user_id)
+        )
+    ''')
+
+    # Subscription plans table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS subscription_plans (
+            plan_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            plan_name TEXT,
+            duration_days INTEGER,
+            price REAL,
+            description TEXT
+        )
+    ''')
+
+    # Default subscription plans
+    cursor.execute('''
+        INSERT OR IGNORE INTO subscription_plans (plan_id, plan_name, duration_days, price, description)
+        VALUES
+            (1, 'Weekly Premium', 7, 4.99, 'Chat with all users for 1 week'),
+            (2, 'Monthly Premium', 30, 14.99, 'Chat with all users for 1 month'),
+            (3, 'Yearly Premium', 365, 99.99, 'Chat with all users for 1 year')
+    ''')
+
+
+def _add_profile_columns(cursor: sqlite3.Cursor):
+    # Databases from early versions predate the favorites questions (formerly update_db.py)
+    columns = {row[1] for row in cursor.execute('PRAGMA table_info(users)').fetchall()}
+    for column in ('favorite_game', 'favorite_movie', 'favorite_music'):
+        if column not in columns:
+            cursor.execute(f'ALTER TABLE users ADD COLUMN {column} TEXT')
+
+
+def _create_indexes(cursor: sqlite3.Cursor):
+    ensure_indexes(cursor)
+
+
+def _add_age_years(cursor: sqlite3.Cursor):
+    # Numeric age next to the free-text answer; existing rows are filled by backfill.py
+    cursor.execute('ALTER TABLE users ADD COLUMN age_years INTEGER')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS backfill_progress (
+            job_name TEXT PRIMARY KEY,
+            last_key INTEGER,
+            rows_done INTEGER DEFAULT 0,
+            completed BOOLEAN DEFAULT FALSE,
+            updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+
+def _create_broadcast_tables(cursor: sqlite3.Cursor):
+    # Resumable broadcasts: recipients go out in user_id order, last_user_id marks how far
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS broadcast_jobs (
+            job_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            message_text TEXT NOT NULL,
+            admin_chat_id INTEGER,
+            total INTEGER DEFAULT 0,
+            status TEXT DEFAULT 'running',
+            last_user_id INTEGER DEFAULT 0,
+            sent INTEGER DEFAULT 0,
+            failed INTEGER DEFAULT 0,
+            progress_message_id INTEGER,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    # Recipients finished above a job's last_user_id; a few rows per job at most
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS broadcast_deliveries (
+            job_id INTEGER,
+            user_id INTEGER,
+            PRIMARY KEY (job_id, user_id),
+            FOREIGN KEY (job_id) REFERENCES broadcast_jobs (job_id)
+        ) WITHOUT ROWID
+    ''')
+
+
+def _create_dead_letter_table(cursor: sqlite3.Cursor):
+    # Chat messages that could not be relayed, kept for inspection
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS relay_dead_letters (
+            dead_letter_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            session_id INTEGER,
+            sender_id INTEGER,
+            recipient_id INTEGER,
+            message_text TEXT,
+            attempts INTEGER,
+            error TEXT,
+            failed_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (session_id) REFERENCES chat_sessions (session_id)
+        )
+    ''')
+
+
+def _add_media_columns(cursor: sqlite3.Cursor):
+    # Relayed media is logged by Telegram file id; message_text holds the caption
+    for table in ('messages', 'relay_dead_letters'):
+        cursor.execute(f'ALTER TABLE {table} ADD COLUMN media_type TEXT')
+        cursor.execute(f'ALTER TABLE {table} ADD COLUMN media_file_id TEXT')
+    cursor.execute('ALTER TABLE messages ADD COLUMN media_file_unique_id TEXT')
+    cursor.execute('ALTER TABLE messages ADD COLUMN media_file_size INTEGER')
+
+
+def _index_broadcast_status(cursor: sqlite3.Cursor):
+    # Resuming broadcasts at startup looks jobs up by status. Not in schema.INDEXES,
+    # which migration 3 creates before broadcast_jobs exists
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_broadcast_jobs_status ON broadcast_jobs (status)')
+
+
+# (version, description, step) in the order they must run; only ever append
+MIGRATIONS: List[Tuple[int, str, Callable[[sqlite3.Cursor], None]]] = [
+    (1, 'Create core tables and default plans', _create_tables),
+    (2, 'Add favorite game/movie/music columns to users', _add_profile_columns),
+    (3, 'Create indexes for chat, message and user queries', _create_indexes),
+    (4, 'Add users.age_years and backfill checkpoints', _add_age_years),
+    (5, 'Create broadcast job and delivery checkpoint tables', _create_broadcast_tables),
+    (6, 'Create relay dead letter table', _create_dead_letter_table),
+    (7, 'Add media columns to messages and relay dead letters', _add_media_columns),
+    (8, 'Index broadcast jobs by status', _index_broadcast_status),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def current_version(conn: sqlite3.Connection) -> int:
+    """Return the applied schema version, 0 for a fresh or unversioned database"""
+    try:
+        row = conn.execute('SELECT MAX(version) FROM schema_version').fetchone()
+    except sqlite3.OperationalError:
+        return 0
+    return row[0] or 0
+
+
+def pending_migrations(conn: sqlite3.Connection) -> List[Tuple[int, str, Callable]]:
+    """Migrations newer than the applied version"""
+    version = current_version(conn)
+    return [m for m in MIGRATIONS if m[0] > version]
+
+
+def migrate(conn: sqlite3.Connection) -> List[int]:
+    """Apply pending migrations, each in its own transaction; returns applied versions"""
+    if current_version(conn) >= LATEST_VERSION:
+        return []
+
+    conn.commit()
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            description TEXT,
+            applied_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+    applied = []
+    for version, description, step in pending_migrations(conn):
+        cursor = conn.cursor()
+        try:
+            cursor.execute('BEGIN')
+            step(cursor)
+            cursor.execute(
+                'INSERT INTO schema_version (version, description) VALUES (?, ?)',
+                (version, description)
+            )
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            logger.error(f"Migration {version} failed: {description}")
+            raise
+        logger.info(f"Applied migration {version}: {description}")
+        applied.append(version)
+    return applied
+
+
+def print_status(conn: sqlite3.Connection):
+    """Print the schema version, pending steps and users columns"""
+    print(f"Schema version: {current_version(conn)} (latest {LATEST_VERSION})")
+    pending = pending_migrations(conn)
+    if pending:
+        print("Pending migrations:")
+        for version, description, _ in pending:
+            print(f"  {version}: {description}")
+    else:
+        print("✅ Schema is up to date")
+
+    print('\nUsers table columns:')
+    for i, row in enumerate(conn.execute('PRAGMA table_info(users)').fetchall()):
+        print(f'  {i}: {row[1]} ({row[2]})')
+
+
+if __name__ == '__main__':
+    logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
+    conn = sqlite3.connect(DATABASE_PATH)
+    try:
+        if len(sys.argv) > 1 and sys.argv[1] == 'status':
+            print_status(conn)
+        else:
+            applied = migrate(conn)
+            print(f"✅ Applied migrations: {applied}" if applied else "✅ Schema is up to date")
+    finally:
+        conn.close()
@@ -0,0 +1,271 @@
+"""
+Outbound send scheduler for Dating Bot
+Every bot-initiated message goes through one queue with priority lanes and Telegram's rate limits
+"""
+import asyncio
+import functools
+import itertools
+import logging
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Set, Tuple
+
+from telegram import Bot
+from telegram.error import RetryAfter
+
+from config import (
+    OUTBOUND_RATE,
+    OUTBOUND_BURST,
+    OUTBOUND_CHAT_RATE,
+    OUTBOUND_CHAT_BURST,
+    OUTBOUND_LANE_WEIGHTS,
+    OUTBOUND_CONCURRENCY,
+    OUTBOUND_STOP_TIMEOUT,
+)
+from matchmaking import WaitStats
+
+logger = logging.getLogger(__name__)
+
+# Lanes, highest weight first
+RELAY = 'relay'  # Chat messages between partners
+LIFECYCLE = 'lifecycle'  # Match found, partner left and other chat notices
+BULK = 'broadcast'  # Admin broadcasts and other mass notifications
+LANES = (RELAY, LIFECYCLE, BULK)
+
+SCAN_DEPTH = 32  # Requests looked at per lane when the head's chat is rate limited
+
+
+class TokenBucket:
+    """Allows rate acquisitions per second with bursts of up to capacity"""
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+
+    def _refill(self, now: float):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self):
+        """Wait for a token"""
+        while True:
+            now = time.monotonic()
+            if now < self._paused_until:
+                await asyncio.sleep(self._paused_until - now)
+                continue
+            self._refill(now)
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return
+            await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    def refund(self):
+        """Return a token that ended up unused"""
+        self._tokens = min(self.capacity, self._tokens + 1)
+
+    def pause(self, seconds: float):
+        """Stop handing out tokens, e.g. after Telegram answers RetryAfter"""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self._tokens = 0
+
+
+class ChatLimiter:
+    """A small token bucket per chat, created on demand"""
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self._buckets: Dict[int, List[float]] = {}  # chat_id: [tokens, updated]
+
+    def _tokens(self, chat_id: int, now: float) -> float:
+        bucket = self._buckets.get(chat_id)
+        if bucket is None:
+            return self.burst
+        return min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+
+    def ready_in(self, chat_id: int, now: float) -> float:
+        """Seconds until chat_id may be sent to, 0 if now"""
+        tokens = self._tokens(chat_id, now)
+        return 0.0 if tokens >= 1 else (1 - tokens) / self.rate
+
+    def take(self, chat_id: int, now: float):
+        self._buckets[chat_id] = [self._tokens(chat_id, now) - 1, now]
+        if len(self._buckets) > 10000:
+            # Chats back at a full burst need no state
+            self._buckets = {
+                chat: bucket for chat, bucket in self._buckets.items()
+                if bucket[0] + (now - bucket[1]) * self.rate < self.burst
+            }
+
+
+class _Request:
+    __slots__ = ('lane', 'chat_id', 'call', 'future', 'queued_at', 'tag')
+
+    def __init__(self, lane: str, chat_id: int, call: Callable[[], Awaitable[Any]],
+                 future: asyncio.Future, tag: float):
+        self.lane = lane
+        self.chat_id = chat_id
+        self.call = call
+        self.future = future
+        self.queued_at = time.monotonic()
+        self.tag = tag  # Virtual finish time for weighted fair queueing
+
+
+class OutboundScheduler:
+    """Weighted fair queueing over priority lanes with global and per-chat rate limits
+
+    Each request gets a virtual finish tag of 1/weight past its lane's previous one,
+    and the eligible request with the lowest tag goes next. Relay wins most contests
+    but a busy relay lane can't starve broadcasts. A chat's requests leave in the
+    order they were queued, one at a time, across all lanes. RetryAfter from any
+    send pauses the whole scheduler, since Telegram's flood limit is per bot.
+    """
+    def __init__(self, rate: float = OUTBOUND_RATE, burst: float = OUTBOUND_BURST,
+                 chat_rate: float = OUTBOUND_CHAT_RATE, chat_burst: float = OUTBOUND_CHAT_BURST,
+                 weights: Dict[str, float] = OUTBOUND_LANE_WEIGHTS, concurrency: int = OUTBOUND_CONCURRENCY):
+        self.bucket = TokenBucket(rate, burst)
+        self.chats = ChatLimiter(chat_rate, chat_burst)
+        self.weights = {lane: float(weights[lane]) for lane in LANES}
+        self._lanes: Dict[str, Deque[_Request]] = {lane: deque() for lane in LANES}
+        self._chat_queues: Dict[int, Deque[_Request]] = {}  # Per-chat order across lanes
+        self._chat_busy: Set[int] = set()  # Chats with a send in flight
+        self._last_tag: Dict[str, float] = {lane: 0.0 for lane in LANES}
+        self._virtual_time = 0.0
+        self._slots = asyncio.Semaphore(concurrency)
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+        # Counters
+        self.sent: Dict[str, int] = {lane: 0 for lane in LANES}
+        self.errors: Dict[str, int] = {lane: 0 for lane in LANES}
+        self.latency: Dict[str, WaitStats] = {lane: WaitStats() for lane in LANES}  # Queued to sent
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self, timeout: float = OUTBOUND_STOP_TIMEOUT):
+        """Give queued sends a moment to go out, then fail the rest"""
+        deadline = time.monotonic() + timeout
+        while len(self) and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        for lane in self._lanes.values():
+            for request in lane:
+                if not request.future.done():
+                    request.future.set_exception(RuntimeError("Outbound scheduler stopped"))
+            lane.clear()
+        self._chat_queues.clear()
+
+    async def submit(self, lane: str, chat_id: int, call: Callable[[], Awaitable[Any]]) -> Any:
+        """Queue call (a send to chat_id) and return its result once it has run"""
+        tag = max(self._virtual_time, self._last_tag[lane]) + 1 / self.weights[lane]
+        self._last_tag[lane] = tag
+        request = _Request(lane, chat_id, call, asyncio.get_running_loop().create_future(), tag)
+        self._lanes[lane].append(request)
+        self._chat_queues.setdefault(chat_id, deque()).append(request)
+        self._wakeup.set()
+        return await request.future
+
+    async def send_message(self, lane: str, bot: Bot, chat_id: int, **kwargs) -> Any:
+        """Queue bot.send_message(chat_id=chat_id, **kwargs)"""
+        return await self.submit(lane, chat_id, functools.partial(bot.send_message, chat_id=chat_id, **kwargs))
+
+    async def copy_message(self, lane: str, bot: Bot, chat_id: int, **kwargs) -> Any:
+        """Queue bot.copy_message(chat_id=chat_id, **kwargs)"""
+        return await self.submit(lane, chat_id, functools.partial(bot.copy_message, chat_id=chat_id, **kwargs))
+
+    def pause(self, seconds: float):
+        self.bucket.pause(seconds)
+
+    def _chat_head(self, chat_id: int) -> Optional[_Request]:
+        queue = self._chat_queues.get(chat_id)
+        while queue and queue[0].future.done():
+            queue.popleft()  # Cancelled by the caller
+        if not queue:
+            self._chat_queues.pop(chat_id, None)
+            return None
+        return queue[0]
+
+    def _pick(self) -> Tuple[Optional[_Request], Optional[float]]:
+        """Eligible request with the lowest tag, or the seconds until one may become eligible"""
+        best: Optional[_Request] = None
+        delay: Optional[float] = None
+        now = time.monotonic()
+        for lane in self._lanes.values():
+            while lane and lane[0].future.done():
+                lane.popleft()
+            for request in itertools.islice(lane, SCAN_DEPTH):
+                if request.future.done() or request.chat_id in self._chat_busy:
+                    continue
+                if self._chat_head(request.chat_id) is not request:
+                    continue
+                wait = self.chats.ready_in(request.chat_id, now)
+                if wait > 0:
+                    delay = wait if delay is None else min(delay, wait)
+                    continue
+                if best is None or request.tag < best.tag:
+                    best = request
+                break  # Later requests in this lane have higher tags
+        return best, delay
+
+    async def _run(self):
+        while True:
+            request, delay = self._pick()
+            if request is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            # Something can go: take a slot and a global token, then choose afresh
+            await self._slots.acquire()
+            await self.bucket.acquire()
+            request, _ = self._pick()
+            if request is None:
+                self.bucket.refund()
+                self._slots.release()
+                continue
+
+            self._lanes[request.lane].remove(request)
+            self._chat_queues[request.chat_id].popleft()
+            self._chat_busy.add(request.chat_id)
+            self.chats.take(request.chat_id, time.monotonic())
+            self._virtual_time = request.tag
+            asyncio.create_task(self._execute(request))
+
+    async def _execute(self, request: _Request):
+        try:
+            result = await request.call()
+        except RetryAfter as e:
+            self.pause(e.retry_after)
+            self.errors[request.lane] += 1
+            if not request.future.done():
+                request.future.set_exception(e)
+        except Exception as e:
+            self.errors[request.lane] += 1
+            if not request.future.done():
+                request.future.set_exception(e)
+        else:
+            self.sent[request.lane] += 1
+            self.latency[request.lane].record(time.monotonic() - request.queued_at)
+            if not request.future.done():
+                request.future.set_result(result)
+        finally:
+            self._chat_busy.discard(request.chat_id)
+            self._slots.release()
+            self._wakeup.set()
+
+    def depth(self, lane: str) -> int:
+        return sum(1 for request in self._lanes[lane] if not request.future.done())
+
+    def __len__(self) -> int:
+        return sum(self.depth(lane) for lane in LANES)
@@ -0,0 +1,114 @@
+"""
+Premium expiry sweeper for Dating Bot
+Downgrades users in the database at the moment their premium expires
+"""
+import asyncio
+import heapq
+import logging
+import threading
+import time
+from datetime import datetime
+from typing import Awaitable, Callable, List, Optional, Tuple
+
+from caches import PremiumCache
+from config import PREMIUM_SWEEP_MAX_SLEEP
+from database import ConnectionPool
+
+logger = logging.getLogger(__name__)
+
+
+class PremiumSweeper:
+    def __init__(self, db: ConnectionPool, premium_cache: PremiumCache,
+                 on_expired: Optional[Callable[[List[int]], Awaitable[None]]] = None,
+                 max_sleep: float = PREMIUM_SWEEP_MAX_SLEEP):
+        self.db = db
+        self.premium_cache = premium_cache
+        self.on_expired = on_expired  # Called with the user ids downgraded in each sweep
+        self.max_sleep = max_sleep
+        self._heap: List[Tuple[float, int]] = []  # (expires_at, user_id); stale entries are skipped
+        self._lock = threading.Lock()
+        self._wake: Optional[asyncio.Event] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._task: Optional[asyncio.Task] = None
+
+        # Counters
+        self.expired = 0
+
+    def start(self):
+        """Load upcoming expirations from the premium cache and start sweeping"""
+        with self._lock:
+            self._heap = [(expires_at, user_id) for user_id, expires_at in self.premium_cache.items()]
+            heapq.heapify(self._heap)
+        self._loop = asyncio.get_running_loop()
+        self._wake = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def schedule(self, user_id: int, expires_at: float):
+        """Track a new expiry; safe to call from database worker threads"""
+        with self._lock:
+            wake = not self._heap or expires_at < self._heap[0][0]
+            heapq.heappush(self._heap, (expires_at, user_id))
+        if wake and self._loop and self._wake:
+            self._loop.call_soon_threadsafe(self._wake.set)
+
+    def _next_delay(self) -> float:
+        with self._lock:
+            if not self._heap:
+                return self.max_sleep
+            return min(max(self._heap[0][0] - time.time(), 0), self.max_sleep)
+
+    async def _run(self):
+        while True:
+            self._wake.clear()
+            try:
+                await asyncio.wait_for(self._wake.wait(), self._next_delay())
+            except asyncio.TimeoutError:
+                pass
+            try:
+                await self.sweep()
+            except Exception as e:
+                logger.error(f"Premium sweep failed: {e}")
+
+    def _pop_due(self, now: float) -> List[Tuple[float, int]]:
+        due = []
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now:
+                due.append(heapq.heappop(self._heap))
+        return due
+
+    async def sweep(self) -> List[int]:
+        """Downgrade every user whose premium has expired; returns their ids"""
+        due = self._pop_due(time.time())
+        # Skip entries superseded by a later activate_premium
+        expired = [user_id for expires_at, user_id in due if self.premium_cache.revoke(user_id, expires_at)]
+        if not expired:
+            return []
+
+        await self.db.run(self._downgrade, expired)
+        self.expired += len(expired)
+        logger.info(f"Premium expired for {len(expired)} users")
+
+        if self.on_expired:
+            await self.on_expired(expired)
+        return expired
+
+    def _downgrade(self, user_ids: List[int]):
+        # premium_expires guard keeps a renewal that raced the sweep
+        now = datetime.now()
+        self.db.executemany('''
+            UPDATE users SET is_premium = FALSE
+            WHERE user_id = ? AND is_premium = TRUE AND premium_expires <= ?
+        ''', [(user_id, now) for user_id in user_ids])
+
+    @property
+    def pending(self) -> int:
+        return len(self._heap)
@@ -0,0 +1,283 @@
+"""
+Relay delivery queue for Dating Bot
+Delivers chat messages to partners in order, retrying transient failures and dead-lettering the rest
+"""
+import asyncio
+import logging
+import random
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Set
+
+from telegram import Bot, Message
+from telegram.constants import MessageLimit
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter
+
+from config import (
+    RELAY_MAX_ATTEMPTS, RELAY_RETRY_BASE, RELAY_RETRY_MAX, RELAY_STOP_TIMEOUT, RELAY_COALESCE_MS,
+)
+from outbound import OutboundScheduler, RELAY
+
+logger = logging.getLogger(__name__)
+
+PREFIX = "💬 Anonymous: "
+
+
+class Media:
+    """A photo, video, voice note, sticker or file, relayed by reference
+
+    Telegram copies the original message itself, so the bytes never pass through
+    the bot and the partner sees no forward header.
+    """
+    __slots__ = ('kind', 'from_chat_id', 'message_id', 'file_id', 'file_unique_id', 'file_size', 'caption')
+
+    def __init__(self, kind: str, from_chat_id: int, message_id: int, file_id: str,
+                 file_unique_id: str, file_size: Optional[int], caption: Optional[str]):
+        self.kind = kind
+        self.from_chat_id = from_chat_id
+        self.message_id = message_id
+        self.file_id = file_id  # Lets the file be sent again without an upload
+        self.file_unique_id = file_unique_id
+        self.file_size = file_size
+        self.caption = caption
+
+
+# Message attributes relayed as media; animation before document, which GIFs also set
+MEDIA_KINDS = ('photo', 'video', 'animation', 'voice', 'video_note', 'audio', 'document', 'sticker')
+
+
+def media_of(message: Message) -> Optional[Media]:
+    """The relayable media in a message, or None"""
+    for kind in MEDIA_KINDS:
+        attachment = getattr(message, kind, None)
+        if not attachment:
+            continue
+        if kind == 'photo':
+            attachment = attachment[-1]  # Largest size; all sizes come along with the copy
+        return Media(kind, message.chat_id, message.message_id, attachment.file_id,
+                     attachment.file_unique_id, attachment.file_size, message.caption)
+    return None
+
+
+class Delivery:
+    """One or more chat messages from a sender on their way to the partner as one message"""
+    __slots__ = ('session_id', 'sender_id', 'recipient_id', 'lines', 'media', 'bot', 'origin',
+                 'attempts', 'queued_at', 'flush_at', 'error', 'ended', 'wake')
+
+    def __init__(self, session_id: int, sender_id: int, recipient_id: int, text: str, bot: Bot,
+                 origin: Any = None, media: Optional[Media] = None):
+        self.session_id = session_id
+        self.sender_id = sender_id
+        self.recipient_id = recipient_id
+        self.lines: List[str] = [text]  # The sender's messages, in order; the caption for media
+        self.media = media  # Copied instead of sent as text; never coalesced
+        self.bot = bot
+        self.origin = origin  # Whatever the callbacks need, e.g. the (update, context) it came from
+        self.attempts = 0
+        self.queued_at = time.monotonic()
+        self.flush_at = self.queued_at  # First send no earlier than this, while more lines may join
+        self.error: Optional[Exception] = None
+        self.ended = False  # The chat is over: one more try at most, no retries
+        self.wake: Optional[asyncio.Event] = None  # Set to cut a wait short
+
+    @property
+    def text(self) -> str:
+        return "\n".join(self.lines)
+
+
+class RelayQueue:
+    """Per-recipient FIFO of relay deliveries with retries
+
+    RetryAfter waits as long as Telegram asks; timeouts and network errors back off
+    exponentially with jitter. A message blocks the ones queued behind it for the
+    same recipient while it retries, so the partner never sees them out of order.
+    With a coalescing window, messages a sender fires off within it are sent as
+    one, up to Telegram's length limit.
+    BadRequest and running out of attempts dead-letter the message and the chat
+    goes on; Forbidden (the partner blocked the bot) dead-letters it and calls
+    on_gone. A read timeout may mean Telegram got the message, so retries can
+    occasionally deliver one twice rather than lose it.
+    """
+    def __init__(self, outbound: OutboundScheduler,
+                 on_delivered: Callable[[Delivery], Awaitable[None]],
+                 on_dead: Callable[[Delivery], Awaitable[None]],
+                 on_gone: Callable[[Delivery], Awaitable[None]],
+                 max_attempts: int = RELAY_MAX_ATTEMPTS, retry_base: float = RELAY_RETRY_BASE,
+                 retry_max: float = RELAY_RETRY_MAX, coalesce_ms: int = RELAY_COALESCE_MS):
+        self.outbound = outbound
+        self.on_delivered = on_delivered
+        self.on_dead = on_dead  # Persists the dead letter and tells the sender
+        self.on_gone = on_gone  # Ends the chat
+        self.max_attempts = max_attempts
+        self.retry_base = retry_base
+        self.retry_max = retry_max
+        self.coalesce_window = coalesce_ms / 1000
+        self._pending: Dict[int, Deque[Delivery]] = {}  # recipient_id: deliveries in order
+        self._workers: Set[asyncio.Task] = set()
+
+        # Counters
+        self.delivered = 0
+        self.retried = 0
+        self.dead = 0
+        self.coalesced = 0  # Messages merged into the one before them
+
+    def submit(self, delivery: Delivery):
+        """Queue a delivery behind any others for the same recipient, or merge it into the last one"""
+        queue = self._pending.get(delivery.recipient_id)
+        if queue is None:
+            queue = self._pending[delivery.recipient_id] = deque()
+            self._spawn(self._drain(delivery.recipient_id, queue))
+        elif queue and self._merge(queue[-1], delivery):
+            return
+        if not delivery.media:
+            delivery.flush_at = delivery.queued_at + self.coalesce_window
+        queue.append(delivery)
+
+    def _merge(self, last: Delivery, delivery: Delivery) -> bool:
+        """Append delivery's lines to last if it is still open for them"""
+        if (last.attempts or last.ended or time.monotonic() >= last.flush_at
+                or last.media or delivery.media
+                or last.sender_id != delivery.sender_id or last.session_id != delivery.session_id):
+            return False
+        merged = last.lines + delivery.lines
+        if len(PREFIX) + sum(len(line) + 1 for line in merged) - 1 > MessageLimit.MAX_TEXT_LENGTH:
+            return False
+        last.lines = merged
+        self.coalesced += len(delivery.lines)
+        return True
+
+    def _spawn(self, coro: Awaitable[None]):
+        task = asyncio.create_task(coro)
+        self._workers.add(task)
+        task.add_done_callback(self._workers.discard)
+
+    async def end_session(self, session_id: int):
+        """Stop retrying a chat that is over and wait until its queued messages have had their try
+
+        Messages not tried yet still go out once, ahead of anything sent after the
+        chat ended; messages waiting to retry are dead-lettered.
+        """
+        while True:
+            queued = [d for queue in self._pending.values() for d in queue if d.session_id == session_id]
+            if not queued:
+                return
+            for delivery in queued:
+                delivery.ended = True
+                if delivery.wake:
+                    delivery.wake.set()
+            await asyncio.sleep(0.05)
+
+    @property
+    def pending(self) -> int:
+        return sum(len(queue) for queue in self._pending.values())
+
+    async def _drain(self, recipient_id: int, queue: Deque[Delivery]):
+        try:
+            while queue:
+                await self._attempt(queue[0])
+                queue.popleft()
+        finally:
+            self._pending.pop(recipient_id, None)
+
+    async def _attempt(self, delivery: Delivery):
+        """Send until it's delivered or dead"""
+        # Give the sender's next lines the rest of the window to join; /stopchat cuts it short
+        if not delivery.ended:
+            await self._wait(delivery, delivery.flush_at - time.monotonic())
+        while True:
+            delivery.attempts += 1
+            try:
+                await self._send(delivery)
+            except Forbidden as e:
+                delivery.error = e
+                await self._dead(delivery)
+                # Ending the chat waits for this queue, so not from inside it
+                self._spawn(self._call(self.on_gone, delivery))
+                return
+            except RetryAfter as e:
+                # The outbound scheduler is paused for as long; come back just after
+                delay = e.retry_after + random.uniform(0, self.retry_base)
+                delivery.error = e
+            except BadRequest as e:
+                # Message too long, chat not found and the like: retrying won't help
+                delivery.error = e
+                await self._dead(delivery)
+                return
+            except NetworkError as e:
+                delay = self._backoff(delivery.attempts)
+                delivery.error = e
+            except Exception as e:
+                delivery.error = e
+                await self._dead(delivery)
+                return
+            else:
+                self.delivered += 1
+                await self._call(self.on_delivered, delivery)
+                return
+
+            if delivery.attempts >= self.max_attempts or delivery.ended:
+                await self._dead(delivery)
+                return
+            self.retried += 1
+            logger.info(
+                f"Relay to {delivery.recipient_id} failed ({delivery.error}); "
+                f"retry {delivery.attempts} in {delay:.1f}s"
+            )
+            await self._wait(delivery, delay)
+            if delivery.ended:
+                await self._dead(delivery)
+                return
+
+    async def _send(self, delivery: Delivery):
+        media = delivery.media
+        if media:
+            await self.outbound.copy_message(
+                RELAY, delivery.bot, delivery.recipient_id,
+                from_chat_id=media.from_chat_id, message_id=media.message_id
+            )
+        else:
+            await self.outbound.send_message(
+                RELAY, delivery.bot, delivery.recipient_id, text=PREFIX + delivery.text
+            )
+
+    async def _wait(self, delivery: Delivery, delay: float):
+        """Sleep up to delay seconds, or until the delivery's chat ends"""
+        if delay <= 0:
+            return
+        delivery.wake = asyncio.Event()
+        try:
+            await asyncio.wait_for(delivery.wake.wait(), delay)
+        except asyncio.TimeoutError:
+            pass
+
+    def _backoff(self, attempts: int) -> float:
+        """Exponential backoff with jitter: between half and all of base * 2^(attempts-1), capped"""
+        delay = min(self.retry_max, self.retry_base * 2 ** (attempts - 1))
+        return random.uniform(delay / 2, delay)
+
+    async def _dead(self, delivery: Delivery):
+        self.dead += 1
+        logger.warning(
+            f"Relay from {delivery.sender_id} to {delivery.recipient_id} dead-lettered "
+            f"after {delivery.attempts} attempts: {delivery.error}"
+        )
+        await self._call(self.on_dead, delivery)
+
+    async def _call(self, callback: Callable[[Delivery], Awaitable[None]], delivery: Delivery):
+        try:
+            await callback(delivery)
+        except Exception as e:
+            logger.error(f"Relay callback failed: {e}")
+
+    async def stop(self, timeout: float = RELAY_STOP_TIMEOUT):
+        """Let queued deliveries finish, then dead-letter whatever is still retrying"""
+        if self._workers:
+            await asyncio.wait(set(self._workers), timeout=timeout)
+        for worker in list(self._workers):
+            worker.cancel()
+        leftover = [d for queue in self._pending.values() for d in queue]
+        if self._workers:
+            await asyncio.gather(*self._workers, return_exceptions=True)
+        for delivery in leftover:
+            delivery.error = RuntimeError("Bot stopped before delivery")
+            await self._dead(delivery)
@@ -0,0 +1,154 @@
+"""
+Index set and query plan audit for Dating Bot
+Keeps the hot queries off full table scans
+"""
+import logging
+import re
+import sqlite3
+from typing import Dict, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Indexes the bot relies on, by name
+INDEXES: Dict[str, str] = {
+    # end_chat pair lookups, active chat counts
+    'idx_chat_sessions_active_user1': '''
+        CREATE INDEX IF NOT EXISTS idx_chat_sessions_active_user1
+        ON chat_sessions (user1_id, user2_id) WHERE is_active = TRUE
+    ''',
+    'idx_chat_sessions_active_user2': '''
+        CREATE INDEX IF NOT EXISTS idx_chat_sessions_active_user2
+        ON chat_sessions (user2_id, user1_id) WHERE is_active = TRUE
+    ''',
+    # Reading a conversation back in order
+    'idx_messages_session_sent': '''
+        CREATE INDEX IF NOT EXISTS idx_messages_session_sent
+        ON messages (session_id, sent_at)
+    ''',
+    # Match pool load and broadcast recipient list
+    'idx_users_active_gender': '''
+        CREATE INDEX IF NOT EXISTS idx_users_active_gender
+        ON users (is_active, gender)
+    ''',
+    # Gender counts in admin_stats
+    'idx_users_gender': '''
+        CREATE INDEX IF NOT EXISTS idx_users_gender
+        ON users (gender)
+    ''',
+    # Premium counts in admin_stats
+    'idx_users_premium': '''
+        CREATE INDEX IF NOT EXISTS idx_users_premium
+        ON users (premium_expires) WHERE is_premium = TRUE
+    ''',
+}
+
+# Every statement DatingBot issues; keep in sync with bot.py, broadcast.py and premium_sweeper.py
+BOT_QUERIES: Dict[str, str] = {
+    'get_user': 'SELECT * FROM users WHERE user_id = ?',
+    'match_profile': 'SELECT favorite_game, favorite_movie, favorite_music, age_years FROM users WHERE user_id = ?',
+    'get_premium_info': 'SELECT is_premium, premium_expires FROM users WHERE user_id = ?',
+    'load_premium_cache': 'SELECT user_id, premium_expires FROM users WHERE is_premium = TRUE',
+    'load_match_pool': 'SELECT user_id, gender FROM users WHERE is_active = TRUE',
+    'close_stale_sessions': 'UPDATE chat_sessions SET is_active = FALSE, ended_at = ? WHERE is_active = TRUE',
+    'end_chat_by_session': 'UPDATE chat_sessions SET is_active = FALSE, ended_at = ? WHERE session_id = ?',
+    'end_chat_by_pair': '''
+        UPDATE chat_sessions SET is_active = FALSE, ended_at = ?
+        WHERE ((user1_id = ? AND user2_id = ?) OR (user1_id = ? AND user2_id = ?))
+        AND is_active = TRUE
+    ''',
+    'save_profile': '''
+        INSERT INTO users
+        (user_id, username, first_name, gender, age, age_years, favorite_game, favorite_movie, favorite_music, interests, photo_url, last_active)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT(user_id) DO UPDATE SET
+            username = excluded.username, first_name = excluded.first_name, gender = excluded.gender,
+            age = excluded.age, age_years = excluded.age_years, favorite_game = excluded.favorite_game,
+            favorite_movie = excluded.favorite_movie, favorite_music = excluded.favorite_music,
+            interests = excluded.interests, photo_url = excluded.photo_url, last_active = excluded.last_active
+    ''',
+    'activate_premium': 'UPDATE users SET is_premium = TRUE, premium_expires = ? WHERE user_id = ?',
+    'get_plan': 'SELECT * FROM subscription_plans WHERE plan_id = ?',
+    'broadcast_recipients': 'SELECT user_id FROM users WHERE user_id > ? AND +is_active = TRUE ORDER BY user_id LIMIT ?',
+    'broadcast_total': 'SELECT COUNT(*) FROM users WHERE is_active = TRUE',
+    'stats_total_users': 'SELECT COUNT(*) FROM users',
+    'stats_total_messages': 'SELECT COUNT(*) FROM messages',
+    'stats_premium': 'SELECT COUNT(*) FROM users WHERE is_premium = TRUE',
+    'stats_active_chats': 'SELECT COUNT(*) FROM chat_sessions WHERE is_active = TRUE',
+    'stats_male': 'SELECT COUNT(*) FROM users WHERE gender = "Male"',
+    'stats_female': 'SELECT COUNT(*) FROM users WHERE gender = "Female"',
+    'save_message': '''
+        INSERT INTO messages
+        (session_id, sender_id, message_text, sent_at,
+         media_type, media_file_id, media_file_unique_id, media_file_size)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ''',
+    'save_dead_letter': '''
+        INSERT INTO relay_dead_letters
+        (session_id, sender_id, recipient_id, message_text, attempts, error, media_type, media_file_id)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ''',
+    # premium_sweeper.py
+    'premium_downgrade': '''
+        UPDATE users SET is_premium = FALSE
+        WHERE user_id = ? AND is_premium = TRUE AND premium_expires <= ?
+    ''',
+    # broadcast.py
+    'broadcast_create': 'INSERT INTO broadcast_jobs (message_text, admin_chat_id, total) VALUES (?, ?, ?)',
+    'broadcast_load_running': 'SELECT job_id FROM broadcast_jobs WHERE status = ? ORDER BY job_id',
+    'broadcast_load_job': '''
+        SELECT job_id, message_text, admin_chat_id, total, status, last_user_id,
+               sent, failed, progress_message_id
+        FROM broadcast_jobs WHERE job_id = ?
+    ''',
+    'broadcast_load_deliveries': 'SELECT user_id FROM broadcast_deliveries WHERE job_id = ?',
+    'broadcast_save_job': '''
+        UPDATE broadcast_jobs
+        SET status = ?, last_user_id = ?, sent = ?, failed = ?, progress_message_id = ?,
+            updated_at = CURRENT_TIMESTAMP
+        WHERE job_id = ?
+    ''',
+    'broadcast_clear_deliveries': 'DELETE FROM broadcast_deliveries WHERE job_id = ?',
+    'broadcast_save_delivery': 'INSERT INTO broadcast_deliveries (job_id, user_id) VALUES (?, ?)',
+    'broadcast_recent': '''
+        SELECT job_id, status, sent, failed, total FROM broadcast_jobs
+        ORDER BY job_id DESC LIMIT ?
+    ''',
+}
+
+
+def ensure_indexes(cursor: sqlite3.Cursor):
+    """Create any missing index from INDEXES"""
+    for sql in INDEXES.values():
+        cursor.execute(sql)
+
+
+def _stops_at_limit(sql: str, plan: List[str]) -> bool:
+    """True for an unfiltered scan that reads rows already in ORDER BY order and stops at LIMIT"""
+    words = set(re.findall(r'[A-Z]+', sql.upper()))
+    return ('LIMIT' in words and 'WHERE' not in words
+            and not any(step.startswith('USE TEMP B-TREE') for step in plan))
+
+
+def find_full_scans(cursor: sqlite3.Cursor, queries: Dict[str, str] = BOT_QUERIES) -> List[Tuple[str, str]]:
+    """Run EXPLAIN QUERY PLAN on each query and return (name, plan step) for full table scans"""
+    scans = []
+    for name, sql in queries.items():
+        params = (None,) * sql.count('?')
+        plan = [row[-1] for row in cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params).fetchall()]
+        # "SCAN users" reads every row; "SCAN ... USING (COVERING) INDEX" only walks an index
+        full = [step for step in plan
+                if step.startswith('SCAN ') and 'USING' not in step and 'CONSTANT ROW' not in step]
+        # Newest-first by rowid with a LIMIT reads LIMIT rows, however big the table
+        if full and not _stops_at_limit(sql, plan):
+            scans.extend((name, step) for step in full)
+    return scans
+
+
+def audit_query_plans(cursor: sqlite3.Cursor, queries: Dict[str, str] = BOT_QUERIES) -> bool:
+    """Log every full table scan left in the bot's queries; True when there are none"""
+    scans = find_full_scans(cursor, queries)
+    for name, detail in scans:
+        logger.warning(f"Full table scan in {name}: {detail}")
+    if not scans:
+        logger.info(f"Query plan audit passed for {len(queries)} statements")
+    return not scans
@@ -0,0 +1,115 @@
+"""
+Concurrent update processing for Dating Bot
+Runs unrelated users in parallel while updates from one user (or one chat pair) stay in order
+"""
+import asyncio
+import contextlib
+import logging
+from collections import deque
+from typing import Any, AsyncIterator, Awaitable, Callable, Deque, Dict, Hashable, Iterable, List, Set, Tuple
+
+from telegram.ext import BaseUpdateProcessor
+
+from config import UPDATE_CONCURRENCY, UPDATE_MAX_IN_FLIGHT
+
+logger = logging.getLogger(__name__)
+
+
+class _Turn:
+    """One update's place in line on each of its keys"""
+    __slots__ = ('keys', 'ready')
+
+    def __init__(self, keys: Set[Hashable]):
+        self.keys = keys
+        self.ready = asyncio.get_running_loop().create_future()  # Set once first in line everywhere
+
+
+class KeyedUpdateProcessor(BaseUpdateProcessor):
+    """Serialize updates that share a key, run the rest concurrently
+
+    key_func maps an update to the keys it must hold, e.g. (user_id,) or the
+    (user_id, partner_id) of a chat. Each key has a FIFO of turns. An update joins
+    the line of every key it needs as soon as it arrives, before anything can
+    suspend it, and runs once it is first in all of them. So updates sharing a key
+    run in arrival order even when the key set changes between them (a chat
+    starts or ends). The earliest waiting update is always first in all its lines,
+    so this can't deadlock.
+    Waiting on a key does not take a handler slot: in-flight updates are capped by
+    max_in_flight, running handlers by max_concurrent.
+    """
+    def __init__(self, key_func: Callable[[object], Tuple[Hashable, ...]],
+                 max_concurrent: int = UPDATE_CONCURRENCY, max_in_flight: int = UPDATE_MAX_IN_FLIGHT):
+        super().__init__(max_in_flight)
+        self.key_func = key_func
+        self.max_concurrent = max_concurrent
+        self._running = asyncio.Semaphore(max_concurrent)
+        self._lines: Dict[Hashable, Deque[_Turn]] = {}  # key -> turns holding or waiting, in arrival order
+
+        # Counters
+        self.processed = 0
+        self.serialized = 0  # Updates that had to wait for an earlier one with the same key
+
+    def _keys(self, update: object) -> List[Hashable]:
+        try:
+            return list(self.key_func(update))
+        except Exception as e:
+            logger.error(f"Update key lookup failed: {e}")
+            return []
+
+    def _first_everywhere(self, turn: _Turn) -> bool:
+        return all(self._lines[key][0] is turn for key in turn.keys)
+
+    @contextlib.asynccontextmanager
+    async def hold(self, keys: Iterable[Hashable]) -> AsyncIterator[bool]:
+        """Hold keys, as an update with those keys would; yields whether it had to wait
+
+        The turn is queued when the context is entered, without suspending first.
+        """
+        turn = _Turn(set(keys))
+        for key in turn.keys:
+            self._lines.setdefault(key, deque()).append(turn)
+        try:
+            waited = not self._first_everywhere(turn)
+            if waited:
+                await turn.ready
+            yield waited
+        finally:
+            # Also reached when cancelled while waiting: leave every line, then let the next ones go
+            nexts = []
+            for key in turn.keys:
+                line = self._lines[key]
+                line.remove(turn)
+                if line:
+                    nexts.append(line[0])
+                else:
+                    del self._lines[key]
+            for waiting in nexts:
+                if not waiting.ready.done() and self._first_everywhere(waiting):
+                    waiting.ready.set_result(None)
+
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        """Wait for every key of the update, then run it within the concurrency limit"""
+        started = False
+        try:
+            async with self.hold(self._keys(update)) as waited:
+                if waited:
+                    self.serialized += 1
+                async with self._running:
+                    started = True
+                    await coroutine
+                self.processed += 1
+        finally:
+            if not started and asyncio.iscoroutine(coroutine):
+                # Cancelled while waiting; don't leave the handler coroutine unawaited
+                coroutine.close()
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    @property
+    def active_keys(self) -> int:
+        """Keys with at least one update holding or waiting for them"""
+        return len(self._lines)
@@ -0,0 +1,194 @@
+"""
+Webhook server for Dating Bot
+Minimal asyncio HTTP server that receives Telegram updates on $PORT
+
+Usage:
+    python webhook.py updates.jsonl [url]   # POST recorded updates to a running bot
+"""
+import asyncio
+import hmac
+import json
+import logging
+import os
+import secrets
+import sys
+import urllib.error
+import urllib.request
+from typing import Dict, Optional, Tuple
+
+from telegram import Update
+from telegram.error import TelegramError
+from telegram.ext import Application
+
+from config import WEBHOOK_PATH, WEBHOOK_MAX_BODY, WEBHOOK_MAX_CONNECTIONS, WEBHOOK_READ_TIMEOUT
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = 'x-telegram-bot-api-secret-token'
+
+REASONS = {
+    200: 'OK', 400: 'Bad Request', 403: 'Forbidden', 404: 'Not Found',
+    405: 'Method Not Allowed', 413: 'Payload Too Large', 503: 'Service Unavailable',
+}
+
+
+class WebhookServer:
+    """Accept updates over HTTP and feed them to the application's update queue
+
+    Telegram retries any non-2xx answer, so a full queue is answered with 503
+    instead of buffering without limit. GET requests answer 200 for health checks.
+    """
+    def __init__(self, application: Application, port: int, host: str = '0.0.0.0',
+                 path: str = WEBHOOK_PATH, secret_token: Optional[str] = None,
+                 max_body: int = WEBHOOK_MAX_BODY):
+        self.application = application
+        self.host = host
+        self.port = port
+        self.path = path
+        if not secret_token:
+            logger.warning("WEBHOOK_SECRET is not set; generated a secret for this run")
+        self.secret_token = secret_token or secrets.token_urlsafe(32)
+        self.max_body = max_body
+        self._server: Optional[asyncio.AbstractServer] = None
+
+        # Counters
+        self.received = 0
+        self.rejected = 0  # Wrong secret, bad path or malformed body
+        self.dropped = 0  # Answered 503 because the update queue was full
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        logger.info(f"Webhook server listening on {self.host}:{self.port}{self.path}")
+
+    async def stop(self):
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def register(self, url: str) -> bool:
+        """Point Telegram at this server; False if the webhook could not be set"""
+        try:
+            await self.application.bot.set_webhook(
+                url=url.rstrip('/') + self.path,
+                secret_token=self.secret_token,
+                allowed_updates=Update.ALL_TYPES,
+                max_connections=WEBHOOK_MAX_CONNECTIONS,
+            )
+        except TelegramError as e:
+            logger.error(f"Setting webhook failed: {e}")
+            return False
+        logger.info(f"Webhook set to {url.rstrip('/')}{self.path}")
+        return True
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        status, body = 400, b''
+        try:
+            method, path, headers, body_in = await asyncio.wait_for(
+                self._read_request(reader), WEBHOOK_READ_TIMEOUT
+            )
+            status = self.dispatch(method, path, headers, body_in)
+        except _HTTPError as e:
+            status = e.status
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, ValueError):
+            status = 400
+        except Exception as e:
+            logger.error(f"Webhook request failed: {e}")
+            status = 400
+
+        if status == 200:
+            body = b'ok'
+        response = (
+            f"HTTP/1.1 {status} {REASONS[status]}\r\n"
+            f"Content-Type: text/plain\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: close\r\n\r\n"
+        ).encode('latin-1') + body
+        try:
+            writer.write(response)
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def _read_request(self, reader: asyncio.StreamReader) -> Tuple[str, str, Dict[str, str], bytes]:
+        method, target, _ = (await reader.readline()).decode('latin-1').split(' ', 2)
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        length = int(headers.get('content-length', 0))
+        if length > self.max_body:
+            raise _HTTPError(413)
+        body = await reader.readexactly(length) if length else b''
+        return method.upper(), target.split('?', 1)[0], headers, body
+
+    def dispatch(self, method: str, path: str, headers: Dict[str, str], body: bytes) -> int:
+        """Handle one request and return its HTTP status"""
+        if method == 'GET':
+            return 200
+        if path != self.path:
+            self.rejected += 1
+            return 404
+        if method != 'POST':
+            return 405
+        if not hmac.compare_digest(headers.get(SECRET_HEADER, ''), self.secret_token):
+            self.rejected += 1
+            return 403
+
+        try:
+            update = Update.de_json(json.loads(body), self.application.bot)
+        except (ValueError, TypeError, KeyError) as e:
+            logger.warning(f"Malformed update: {e}")
+            self.rejected += 1
+            return 400
+
+        try:
+            self.application.update_queue.put_nowait(update)
+        except asyncio.QueueFull:
+            # Telegram redelivers later; that's our backpressure
+            self.dropped += 1
+            return 503
+        self.received += 1
+        return 200
+
+
+class _HTTPError(Exception):
+    def __init__(self, status: int):
+        super().__init__(status)
+        self.status = status
+
+
+def replay(path: str, url: str, secret_token: str) -> Dict[int, int]:
+    """POST every JSON update in a .jsonl file to url; returns a count per HTTP status"""
+    statuses: Dict[int, int] = {}
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            request = urllib.request.Request(
+                url, data=line.strip().encode('utf-8'), method='POST',
+                headers={'Content-Type': 'application/json', SECRET_HEADER: secret_token},
+            )
+            try:
+                with urllib.request.urlopen(request) as response:
+                    status = response.status
+            except urllib.error.HTTPError as e:
+                status = e.code
+            statuses[status] = statuses.get(status, 0) + 1
+    return statuses
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print(__doc__)
+        sys.exit(1)
+    default_url = f"http://localhost:{os.getenv('PORT', '8443')}{WEBHOOK_PATH}"
+    url = sys.argv[2] if len(sys.argv) > 2 else default_url
+    print(f"📨 Replaying {sys.argv[1]} to {url}")
+    print(f"✅ Responses: {replay(sys.argv[1], url, os.getenv('WEBHOOK_SECRET', ''))}")